@@ -0,0 +1,75 @@
+import asyncio, time
+from typing import Any
+
+import httpx
+
+from client import IDEMPOTENT_METHODS, record, spotify, strava
+from constants import HTTP_BACKOFF, HTTP_POOL_SIZE, HTTP_RETRIES, HTTP_TIMEOUT, SPOTIFY_API_URL, STRAVA_API_URL
+from governor import Governor
+
+
+class AsyncClient(httpx.AsyncClient):
+    '''Asynchronous counterpart of `Client`, which keeps pooled connections to an api alive, paces requests with a
+    governor and retries throttled or failed requests.'''
+    
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        governor: Governor | None = None,
+        pool_size: int = HTTP_POOL_SIZE,
+        timeout: float = HTTP_TIMEOUT,
+        retries: int = HTTP_RETRIES,
+        backoff: float = HTTP_BACKOFF
+    ):
+        # connection failures are retried by the transport, everything else below
+        super().__init__(
+            base_url=f'{base_url}/',
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=httpx.AsyncHTTPTransport(retries=retries)
+        )
+        self.name = name
+        self.governor = governor
+        self.retries = retries
+        self.backoff = backoff
+    
+    
+    async def request(self, method: str, url: httpx.URL | str, *args: Any, **kwargs: Any) -> httpx.Response: # type: ignore # narrower than the base signature
+        started = time.perf_counter()
+        try:
+            response = await self._send(method, url, *args, **kwargs)
+        except httpx.HTTPError as e:
+            record(self.name, method, started, type(e).__name__)
+            raise
+        
+        record(self.name, method, started, response.status_code)
+        return response
+    
+    
+    async def _send(self, method: str, url: httpx.URL | str, *args: Any, **kwargs: Any) -> httpx.Response:
+        for attempt in range(self.retries + 1):
+            if self.governor is not None:
+                await self.governor.aacquire()
+            
+            response = await super().request(method, url, *args, **kwargs)
+            if self.governor is not None:
+                await self.governor.aupdate(response)
+            
+            # the governor already waits for as long as a 429 asks
+            if response.status_code == 429 and self.governor is not None:
+                continue
+            
+            # a throttled request was never processed, unlike a failed one
+            failed = response.status_code in (500, 502, 503, 504) and method.upper() in IDEMPOTENT_METHODS
+            if (response.status_code == 429 or failed) and attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+                continue
+            return response
+        
+        return response # type: ignore # there is always at least one attempt
+
+
+# the budgets are shared with the synchronous clients
+astrava = AsyncClient('strava', STRAVA_API_URL, strava.governor)
+aspotify = AsyncClient('spotify', SPOTIFY_API_URL, spotify.governor)
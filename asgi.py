@@ -0,0 +1,94 @@
+'''The same app as `main`, but served asynchronously so that one process can handle many events at once.
+
+usage: hypercorn asgi:app'''
+
+import asyncio
+from typing import Any
+
+from quart import Quart, redirect, request, url_for
+
+from aclient import aspotify, astrava
+from constants import ASYNC_WORKERS, JOBS_FOLDER, SECRET_KEY, SERVER_NAME
+from events import ahandle_event, handle_event
+from jobqueue import JobQueue
+from user import User
+import web
+
+
+app = Quart(__name__)
+app.config['SERVER_NAME'] = SERVER_NAME
+app.config['SECRET_KEY'] = SECRET_KEY
+app.config['PREFERRED_URL_SCHEME'] = 'https'
+
+# events are still persisted and retried by the queue, but its workers only wait for the event loop
+queue = JobQueue(JOBS_FOLDER, handle_event, ASYNC_WORKERS)
+web.collect(queue)
+
+
+@app.before_serving
+async def start():
+    loop = asyncio.get_running_loop()
+    
+    def handle(event: dict[str, Any]):
+        asyncio.run_coroutine_threadsafe(ahandle_event(event), loop).result()
+    
+    queue.handler = handle
+    queue.start()
+
+
+@app.after_serving
+async def stop():
+    await asyncio.gather(astrava.aclose(), aspotify.aclose())
+
+
+def error(message: str):
+    return redirect(url_for('index', message=message), 303)
+
+
+@app.route('/login')
+async def login():
+    # redirects to strava authorization
+    redirect_uri = url_for('callback', _external=True, _scheme='https')
+    return redirect(web.strava_authorization(redirect_uri))
+
+
+@app.route('/callback')
+async def callback():
+    try:
+        jwt = web.callback_state(request.args)
+    except web.CallbackError as e:
+        return error(str(e))
+    
+    if jwt.src == 'strava':
+        # redirects to spotify authorization
+        user = await User.astrava_authorize(request.args['code'])
+        redirect_uri = url_for('callback', _external=True, _scheme='https')
+        return redirect(web.spotify_authorization(redirect_uri, user.id))
+    
+    url = request.base_url.replace('http:', 'https:')
+    await User(str(jwt.user_id)).aspotify_authorize(request.args['code'], url)
+    return error('Subscribed successfully!') # :clueless:
+
+
+@app.route('/webhook', methods=['GET', 'POST'])
+async def webhook():
+    if request.method == 'GET':
+        return web.verify_webhook(request.args)
+    
+    # acknowledge immediately and let the event loop talk to strava and spotify
+    web.receive(await request.get_json(silent=True), queue)
+    return 'EVENT_RECEIVED', 200
+
+
+@app.route('/')
+async def index():
+    return request.args.get('message', 'hiiiiiii')
+
+
+@app.route('/metrics')
+async def metrics():
+    return web.metrics()
+
+
+if __name__ == '__main__':
+    app.run('0.0.0.0')
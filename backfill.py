@@ -0,0 +1,118 @@
+'''Adds music to activities which happened before a user subscribed or whose webhook events were missed.
+
+Spotify only remembers the last 50 tracks a user played, so older activities are skipped when no music is found for
+them. Progress is checkpointed in every user, so a run which is interrupted or runs out of budget can simply be resumed.
+
+usage: python backfill.py [user ids...] [--workers N] [--strava-budget N] [--spotify-budget N]'''
+
+import threading, traceback
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, cast
+
+from events import write_description
+from governor import RateLimited, background
+from tracks import played, window
+from user import User
+
+
+PER_PAGE = 100
+
+
+class BudgetExhausted(Exception):
+    '''Raised when an api may not be called any more during this run.'''
+
+
+class Budget:
+    '''Number of calls which may still be made to an api during this run, shared by every worker.'''
+    
+    def __init__(self, name: str, calls: int | None = None):
+        self.name = name
+        self.calls = calls
+        self._lock = threading.Lock()
+    
+    
+    def spend(self, calls: int = 1):
+        with self._lock:
+            if self.calls is None:
+                return
+            
+            if self.calls < calls:
+                raise BudgetExhausted(f'The {self.name} budget is exhausted.')
+            self.calls -= calls
+
+
+def backfill(user: User, strava: Budget, spotify: Budget) -> int:
+    '''Describes every activity of a user after their checkpoint and returns how many were described.'''
+    
+    count = 0
+    while True:
+        # with `after`, strava lists the oldest activities first, so the checkpoint moves forward page by page
+        strava.spend()
+        activities = user.strava_request('GET', f'athlete/activities?after={user.backfill_after}&per_page={PER_PAGE}')
+        if not isinstance(activities, list):
+            raise RuntimeError(f'Could not list the activities of user {user.id}: {activities}')
+        if not activities:
+            return count
+        
+        checkpoint = latest = user.backfill_after
+        try:
+            for activity in cast(list[dict[str, Any]], activities):
+                start, end = window(activity)
+                if activity['id'] not in user.activities:
+                    items = played(user, start, end, spotify.spend)
+                    if items:
+                        strava.spend(2)
+                        with user.transaction():
+                            # a webhook may have handled the activity in the meantime
+                            if activity['id'] not in user.activities:
+                                detailed = user.strava_request('GET', f'activities/{activity["id"]}')
+                                write_description(user, activity['id'], detailed, items)
+                                count += 1
+                
+                latest = max(latest, int(start))
+        finally:
+            # the checkpoint is written once per page, even if the page was interrupted, and the transaction picks up
+            # whatever webhooks and token refreshes wrote in the meantime rather than conflicting with them
+            if latest > checkpoint:
+                with user.transaction():
+                    user.backfill_after = max(user.backfill_after, latest)
+        
+        # don't ask for the same page forever if strava ignores the checkpoint
+        if latest == checkpoint:
+            return count
+
+
+def main(ids: list[str], workers: int, strava: Budget, spotify: Budget):
+    if not ids:
+        ids = User.ids(active=True)
+    
+    def run(id: str):
+        user = User(id)
+        if not user.active:
+            return
+        
+        try:
+            # webhooks keep a share of the rate limits for themselves
+            with background():
+                count = backfill(user, strava, spotify)
+            print(f'Described {count} activities of user {id}.')
+        except (BudgetExhausted, RateLimited) as e:
+            print(f'Stopped backfilling user {id}: {e}')
+        except Exception:
+            print(f'Failed to backfill user {id}.')
+            traceback.print_exc()
+    
+    with ThreadPoolExecutor(workers) as executor:
+        executor.map(run, ids)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Adds music to activities which happened before users subscribed.')
+    parser.add_argument('ids', nargs='*', help='users to backfill (default: every active one)')
+    parser.add_argument('--workers', type=int, default=4, help='how many users are backfilled at once (default: 4)')
+    parser.add_argument('--strava-budget', type=int, help='maximum number of strava calls (default: unlimited)')
+    parser.add_argument('--spotify-budget', type=int, help='maximum number of spotify calls (default: unlimited)')
+    args = parser.parse_args()
+    
+    main(args.ids, args.workers, Budget('strava', args.strava_budget), Budget('spotify', args.spotify_budget))
@@ -0,0 +1,196 @@
+'''Local stand-ins for the strava and spotify apis, which answer with made up athletes, activities and tracks after a
+configurable latency, and fail or throttle a configurable share of requests.
+
+usage: python -m benchmarks.fakeapi [--port N] [--latency MS] [--errors RATE] [--throttle RATE]'''
+
+import json, random, threading, time
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, cast
+from urllib.parse import parse_qs, urlparse
+
+
+# how many distinct tracks the athletes listen to
+TRACKS = 500
+
+
+def iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+class FakeAPI(ThreadingHTTPServer):
+    '''Serves strava under /strava/api/v3, spotify under /spotify/v1 and spotify's accounts under /spotify-accounts.'''
+    
+    daemon_threads = True
+    
+    def __init__(self, port: int = 0, latency: float = 0, errors: float = 0, throttle: float = 0):
+        super().__init__(('127.0.0.1', port), Handler)
+        self.latency = latency
+        self.errors = errors
+        self.throttle = throttle
+        
+        self.lock = threading.Lock()
+        self.descriptions: dict[int, str] = {}
+        self.requests = 0
+        self.usage = 0
+    
+    
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+    
+    
+    def environ(self) -> dict[str, str]:
+        '''Returns the environment variables which point the app at this server.'''
+        
+        return {
+            'STRAVA_API_URL': f'{self.url}/strava/api/v3',
+            'SPOTIFY_API_URL': f'{self.url}/spotify/v1',
+            'SPOTIFY_ACCOUNTS_URL': f'{self.url}/spotify-accounts'
+        }
+    
+    
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fakeapi', daemon=True).start()
+        return self
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, format: str, *args: Any):
+        pass
+    
+    
+    def do_GET(self):
+        self.handle_request('GET')
+    
+    
+    def do_POST(self):
+        self.handle_request('POST')
+    
+    
+    def do_PUT(self):
+        self.handle_request('PUT')
+    
+    
+    def send(self, status: int, body: Any, headers: dict[str, str] | None = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    
+    def handle_request(self, method: str):
+        server = cast(FakeAPI, self.server)
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        
+        with server.lock:
+            server.requests += 1
+            server.usage += 1
+            usage = server.usage
+        
+        if server.latency:
+            time.sleep(server.latency)
+        
+        strava = url.path.startswith('/strava/')
+        limits = {'X-RateLimit-Limit': '1000000000,1000000000', 'X-RateLimit-Usage': f'{usage},{usage}'} if strava else {}
+        if random.random() < server.throttle:
+            return self.send(429, {'message': 'Rate Limit Exceeded'}, limits if strava else {'Retry-After': '1'})
+        if random.random() < server.errors:
+            return self.send(503, {'message': 'Service Unavailable'}, limits)
+        
+        path = url.path.split('/')
+        match method, url.path:
+            case 'POST', '/strava/api/v3/oauth/token':
+                # the code of an authorization is the id of the athlete
+                athlete = int(form.get('code') or 0) or random.randrange(1, 10**6)
+                self.send(200, {
+                    'athlete': {'id': athlete},
+                    'refresh_token': f'refresh-{athlete}',
+                    'access_token': f'access-{athlete}-{random.random()}',
+                    'expires_at': int(time.time()) + 6 * 60 * 60
+                }, limits)
+            
+            case 'POST', '/spotify-accounts/api/token':
+                self.send(200, {
+                    'refresh_token': 'refresh',
+                    'access_token': f'access-{random.random()}',
+                    'expires_in': 3600
+                })
+            
+            case 'GET', _ if url.path.startswith('/strava/api/v3/activities/'):
+                # every activity ended a minute ago and took half an hour
+                id = int(path[-1])
+                start = time.time() - 31 * 60
+                with server.lock:
+                    description = server.descriptions.get(id)
+                self.send(200, {'id': id, 'start_date': iso(start), 'elapsed_time': 30 * 60, 'description': description}, limits)
+            
+            case 'PUT', _ if url.path.startswith('/strava/api/v3/activities/'):
+                id = int(path[-1])
+                with server.lock:
+                    server.descriptions[id] = form.get('description', '')
+                self.send(200, {'id': id}, limits)
+            
+            case 'GET', '/strava/api/v3/athlete/activities':
+                after = int(query.get('after', 0))
+                start = max(after + 1, int(time.time()) - 24 * 60 * 60)
+                self.send(200, [{
+                    'id': start + i,
+                    'start_date': iso(start + i * 60 * 60),
+                    'elapsed_time': 30 * 60
+                } for i in range(min(int(query.get('per_page', 30)), 5)) if start + i * 60 * 60 < time.time()], limits)
+            
+            case 'GET', '/spotify/v1/me/player/recently-played':
+                # a track was played every three minutes
+                before = int(query.get('before', time.time() * 1000)) / 1000
+                limit = int(query.get('limit', 20))
+                items = [{
+                    'played_at': iso(before - (i + 1) * 180),
+                    'track': track(random.randrange(TRACKS))
+                } for i in range(limit)]
+                self.send(200, {
+                    'items': items,
+                    'next': 'more',
+                    'cursors': {'after': str(int(before * 1000)), 'before': str(int((before - limit * 180) * 1000))}
+                })
+            
+            case 'GET', '/spotify/v1/tracks':
+                self.send(200, {'tracks': [track(int(id.removeprefix('track'))) for id in query['ids'].split(',')]})
+            
+            case 'GET', '/spotify/v1/audio-features':
+                self.send(200, {'audio_features': [{'id': id, 'tempo': 120.0} for id in query['ids'].split(',')]})
+            
+            case _:
+                self.send(404, {'message': 'Not Found'})
+
+
+def track(number: int) -> dict[str, Any]:
+    return {
+        'id': f'track{number}',
+        'name': f'Track {number}',
+        'artists': [{'name': f'Artist {number % 50}'}],
+        'album': {'name': f'Album {number % 100}'},
+        'duration_ms': 180000
+    }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Serves stand-ins for the strava and spotify apis.')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on (default: 8000)')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds before every response (default: 0)')
+    parser.add_argument('--errors', type=float, default=0, help='share of requests which fail with a 503 (default: 0)')
+    parser.add_argument('--throttle', type=float, default=0, help='share of requests which fail with a 429 (default: 0)')
+    args = parser.parse_args()
+    
+    server = FakeAPI(args.port, args.latency / 1000, args.errors, args.throttle)
+    for name, value in server.environ().items():
+        print(f'export {name}={value}')
+    server.serve_forever()
@@ -0,0 +1,359 @@
+'''Drives the app with synthetic athletes against local stand-ins for strava and spotify, and reports latencies,
+throughput, disk writes and memory growth. Results can be saved and compared with a baseline to catch regressions.
+
+usage: python -m benchmarks.load [--app flask|asgi] [--athletes N] [--events N] [--concurrency N] [--latency MS]
+                                 [--errors RATE] [--throttle RATE] [--storage URL] [--journal] [--compact]
+                                 [--flush-interval S] [--pool-size N] [--retries N] [--workers N]
+                                 [--save FILE] [--compare FILE] [--tolerance RATE]'''
+
+import asyncio, json, os, resource, statistics, sys, tempfile, threading, time
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.fakeapi import FakeAPI
+
+
+HOST = 'localhost'
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict[str, float]:
+    '''Returns latency percentiles in milliseconds and the throughput of a phase.'''
+    
+    return {
+        'count': len(latencies),
+        'p50': percentile(latencies, 0.5) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'mean': (statistics.fmean(latencies) if latencies else 0) * 1000,
+        'per_second': len(latencies) / elapsed if elapsed else 0
+    }
+
+
+def rss() -> int:
+    '''Returns the resident memory of this process in bytes.'''
+    
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def written() -> int:
+    '''Returns how many bytes this process has caused to be written to disk, or 0 if that isn't known.'''
+    
+    try:
+        with open('/proc/self/io') as file:
+            for line in file:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def size(folder: str) -> int:
+    total = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def configure(args: Namespace, server: FakeAPI):
+    '''Points the app at the stand-ins and configures it, which must happen before it is imported.'''
+    
+    os.environ.update(server.environ())
+    os.environ.setdefault('SECRET_KEY', 'benchmark-secret-which-is-long-enough')
+    os.environ.setdefault('STRAVA_CLIENT_ID', 'benchmark')
+    os.environ.setdefault('STRAVA_CLIENT_SECRET', 'benchmark')
+    os.environ.setdefault('SPOTIFY_CLIENT_ID', 'benchmark')
+    os.environ.setdefault('SPOTIFY_CLIENT_SECRET', 'benchmark')
+    os.environ.update({
+        'SERVER_NAME': HOST,
+        'STORAGE': args.storage,
+        'JOURNAL': '1' if args.journal else '0',
+        'COMPACT_STORAGE': '1' if args.compact else '0',
+        'FLUSH_INTERVAL': str(args.flush_interval),
+        'HTTP_POOL_SIZE': str(args.pool_size),
+        'HTTP_RETRIES': str(args.retries),
+        'WORKERS': str(args.workers),
+        'ASYNC_WORKERS': str(args.workers),
+        'STRAVA_RATE_LIMITS': '1000000000,1000000000'
+    })
+
+
+def authorize(get: Callable[[str], tuple[int, str]], athlete: int) -> float:
+    '''Goes through the strava and spotify callbacks of an athlete, and returns how long that took.'''
+    
+    from state import JWT
+    
+    started = time.perf_counter()
+    status, location = get(f'/callback?code={athlete}&state={JWT(src="strava")}')
+    assert status in (302, 303), f'The strava callback failed with {status}.'
+    
+    state = parse_qs(urlparse(location).query)['state'][0]
+    status, location = get(f'/callback?code=spotify&state={state}')
+    assert 'Subscribed' in location, f'The spotify callback failed with {location}.'
+    return time.perf_counter() - started
+
+
+def event(athlete: int, activity: int) -> dict[str, Any]:
+    return {
+        'aspect_type': 'create',
+        'object_type': 'activity',
+        'object_id': activity,
+        'owner_id': athlete,
+        'event_time': int(time.time()),
+        'subscription_id': 1,
+        'updates': {}
+    }
+
+
+class Tracker:
+    '''Records when every event was posted and when its job finished.'''
+    
+    def __init__(self, handler: Callable[[dict[str, Any]], Any]):
+        self.handler = handler
+        self.posted: dict[int, float] = {}
+        self.latencies: list[float] = []
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)
+    
+    
+    def post(self, activity: int):
+        with self.lock:
+            self.posted[activity] = time.perf_counter()
+    
+    
+    def __call__(self, event: dict[str, Any]):
+        self.handler(event)
+        with self.lock:
+            self.latencies.append(time.perf_counter() - self.posted[event['object_id']])
+            self.done.notify_all()
+    
+    
+    def wait(self, count: int, failed: Callable[[], int], timeout: float):
+        deadline = time.time() + timeout
+        with self.lock:
+            while len(self.latencies) + failed() < count and time.time() < deadline:
+                self.done.wait(0.1)
+
+
+def run_flask(args: Namespace, athletes: list[int], events: list[dict[str, Any]]) -> dict[str, Any]:
+    import main
+    
+    local = threading.local()
+    
+    def client() -> Any:
+        # test clients keep cookies, so every thread gets its own
+        if not hasattr(local, 'client'):
+            local.client = main.app.test_client()
+        return local.client
+    
+    def get(path: str) -> tuple[int, str]:
+        response = client().get(path, base_url=f'https://{HOST}')
+        return response.status_code, response.headers.get('Location', '')
+    
+    def post(event: dict[str, Any]) -> float:
+        tracker.post(event['object_id'])
+        started = time.perf_counter()
+        client().post('/webhook', json=event, base_url=f'https://{HOST}')
+        return time.perf_counter() - started
+    
+    results: dict[str, Any] = {}
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        started = time.perf_counter()
+        latencies = list(executor.map(partial(authorize, get), athletes))
+        results['callback'] = summarize(latencies, time.perf_counter() - started)
+        
+        tracker = Tracker(main.queue.handler)
+        main.queue.handler = tracker
+        started = time.perf_counter()
+        latencies = list(executor.map(post, events))
+        results['webhook'] = summarize(latencies, time.perf_counter() - started)
+    
+    tracker.wait(len(events), lambda: main.queue.failed, args.timeout)
+    results['event'] = summarize(tracker.latencies, time.perf_counter() - started)
+    results['event']['failed'] = main.queue.failed
+    return results
+
+
+def run_asgi(args: Namespace, athletes: list[int], events: list[dict[str, Any]]) -> dict[str, Any]:
+    import asgi
+    
+    async def run() -> dict[str, Any]:
+        results: dict[str, Any] = {}
+        semaphore = asyncio.Semaphore(args.concurrency)
+        async with asgi.app.test_app() as app:
+            client = app.test_client()
+            
+            async def authorize(athlete: int) -> float:
+                from state import JWT
+                
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.get(f'/callback?code={athlete}&state={JWT(src="strava")}', headers={'Host': HOST})
+                    state = parse_qs(urlparse(response.headers['Location']).query)['state'][0]
+                    response = await client.get(f'/callback?code=spotify&state={state}', headers={'Host': HOST})
+                    assert 'Subscribed' in response.headers['Location'], 'The spotify callback failed.'
+                    return time.perf_counter() - started
+            
+            async def post(event: dict[str, Any]) -> float:
+                async with semaphore:
+                    tracker.post(event['object_id'])
+                    started = time.perf_counter()
+                    await client.post('/webhook', json=event, headers={'Host': HOST})
+                    return time.perf_counter() - started
+            
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*map(authorize, athletes))
+            results['callback'] = summarize(list(latencies), time.perf_counter() - started)
+            
+            tracker = Tracker(asgi.queue.handler)
+            asgi.queue.handler = tracker
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*map(post, events))
+            results['webhook'] = summarize(list(latencies), time.perf_counter() - started)
+            
+            await asyncio.to_thread(tracker.wait, len(events), lambda: asgi.queue.failed, args.timeout)
+            results['event'] = summarize(tracker.latencies, time.perf_counter() - started)
+            results['event']['failed'] = asgi.queue.failed
+        return results
+    
+    return asyncio.run(run())
+
+
+def run_storage(athletes: list[int]) -> dict[str, Any]:
+    '''Measures loading and saving the users which were created by the other phases.'''
+    
+    from user import User
+    
+    folder = str(User.FOLDER)
+    data = {athlete: User.STORAGE.load(folder, str(athlete)) or {} for athlete in athletes}
+    
+    started = time.perf_counter()
+    latencies: list[float] = []
+    for athlete in athletes:
+        before = time.perf_counter()
+        User.STORAGE.load(folder, str(athlete))
+        latencies.append(time.perf_counter() - before)
+    load = summarize(latencies, time.perf_counter() - started)
+    
+    started = time.perf_counter()
+    latencies = []
+    for athlete in athletes:
+        before = time.perf_counter()
+        User.STORAGE.save(folder, str(athlete), data[athlete])
+        latencies.append(time.perf_counter() - before)
+    User.STORAGE.flush()
+    save = summarize(latencies, time.perf_counter() - started)
+    
+    return {'load': load, 'save': save}
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    '''Returns the metrics which are worse than the baseline by more than the tolerance.'''
+    
+    regressions: list[str] = []
+    for phase, metrics in baseline.get('phases', {}).items():
+        current = results['phases'].get(phase, {})
+        for name, higher in (('p50', False), ('p99', False), ('per_second', True)):
+            old, new = metrics.get(name), current.get(name)
+            if not old or new is None:
+                continue
+            change = (old - new) / old if higher else (new - old) / old
+            if change > tolerance:
+                regressions.append(f'{phase} {name}: {old:.2f} -> {new:.2f} ({change:+.0%})')
+    return regressions
+
+
+def main(args: Namespace) -> int:
+    server = FakeAPI(0, args.latency / 1000, args.errors, args.throttle).start()
+    configure(args, server)
+    
+    # the app keeps its data relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='spotipy-load-'))
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    
+    athletes = list(range(1, args.athletes + 1))
+    events = [event(athletes[i % len(athletes)], 10**9 + i) for i in range(args.events)]
+    
+    rss_before = rss()
+    written_before = written()
+    started = time.perf_counter()
+    
+    phases = run_asgi(args, athletes, events) if args.app == 'asgi' else run_flask(args, athletes, events)
+    phases.update(run_storage(athletes))
+    
+    results: dict[str, Any] = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('save', 'compare')},
+        'phases': phases,
+        'elapsed': time.perf_counter() - started,
+        'requests': server.requests,
+        'disk_written': written() - written_before,
+        'data_size': size('data'),
+        'rss_growth': rss() - rss_before
+    }
+    
+    print(f'{"phase":<10} {"count":>7} {"p50 ms":>9} {"p99 ms":>9} {"mean ms":>9} {"per s":>9}')
+    for phase, metrics in phases.items():
+        print(f'{phase:<10} {metrics["count"]:>7} {metrics["p50"]:>9.2f} {metrics["p99"]:>9.2f} {metrics["mean"]:>9.2f} {metrics["per_second"]:>9.1f}')
+    print()
+    print(f'failed events: {phases["event"]["failed"]}')
+    print(f'api requests:  {results["requests"]}')
+    print(f'disk written:  {results["disk_written"] / 1024:.0f} KiB ({results["data_size"] / 1024:.0f} KiB of data)')
+    print(f'rss growth:    {results["rss_growth"] / 1024 / 1024:.1f} MiB')
+    
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=4)
+    
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f'regression: {regression}')
+        if regressions:
+            return 1
+    
+    return 0
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Load tests the app against local stand-ins for strava and spotify.')
+    parser.add_argument('--app', choices=('flask', 'asgi'), default='flask', help='which app to drive (default: flask)')
+    parser.add_argument('--athletes', type=int, default=50, help='number of synthetic athletes (default: 50)')
+    parser.add_argument('--events', type=int, default=500, help='number of webhook events (default: 500)')
+    parser.add_argument('--concurrency', type=int, default=16, help='requests in flight at once (default: 16)')
+    parser.add_argument('--latency', type=float, default=50, help='milliseconds before every api response (default: 50)')
+    parser.add_argument('--errors', type=float, default=0, help='share of api requests which fail (default: 0)')
+    parser.add_argument('--throttle', type=float, default=0, help='share of api requests which are throttled (default: 0)')
+    parser.add_argument('--storage', default='file', help='storage backend, `file` or `sqlite:///<path>` (default: file)')
+    parser.add_argument('--journal', action='store_true', help='journal changes to activities')
+    parser.add_argument('--compact', action='store_true', help='write users without indentation')
+    parser.add_argument('--flush-interval', type=float, default=0, help='seconds between background writes (default: 0)')
+    parser.add_argument('--pool-size', type=int, default=10, help='http connections per api (default: 10)')
+    parser.add_argument('--retries', type=int, default=3, help='http retries (default: 3)')
+    parser.add_argument('--workers', type=int, default=4, help='queue workers (default: 4)')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for the events to be handled (default: 300)')
+    parser.add_argument('--save', help='write the results to a json file')
+    parser.add_argument('--compare', help='compare the results with a json file and fail on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='how much worse than the baseline is tolerated (default: 0.2)')
+    
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,61 @@
+'''Measures the cost of rendering descriptions, without any network calls.
+
+usage: python -m benchmarks.render [track counts...]'''
+
+import sys, timeit
+from typing import Any, Callable
+
+from renderer import Context, Template, compiled
+from track import Track
+
+
+TEMPLATES = {
+    'default': '🎵 Music Of The Activity 🎵\n{tracks}',
+    'full': '🎵 Music Of The Activity 🎵\n{tracks}\n\n{top_artists}\n{minutes}\n{playlist}'
+}
+
+
+def concatenated(tracks: list[Track]) -> str:
+    # how descriptions were built before templates
+    description = '🎵 Music Of The Activity 🎵'
+    for track in tracks:
+        description += f'\n{track.name} - {track.artists[0] if track.artists else ""}'
+        if track.tempo:
+            description += f' ({track.tempo:.0f} BPM)'
+    return description
+
+
+def measure(function: Callable[[], Any], number: int) -> float:
+    '''Returns the best time per call in microseconds.'''
+    
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def main(counts: list[int]):
+    print(f'{"tracks":>10} {"case":<28} {"us/call":>10}')
+    for count in counts:
+        # tracks without an id are never stored
+        tracks = [
+            Track().set(name=f'Track {i}', artists=[f'Artist {i % 7}', f'Artist {i % 11}'], duration_ms=180000, tempo=120 + i % 40)
+            for i in range(count)
+        ]
+        context = Context(tracks, playlist='https://open.spotify.com/playlist/0')
+        number = max(10, 100000 // (count + 10))
+        
+        cases: dict[str, Callable[[], Any]] = {
+            'concatenation (before)': lambda: concatenated(tracks),
+            'compile default': lambda: Template(TEMPLATES['default']),
+            'compile full': lambda: Template(TEMPLATES['full'])
+        }
+        for name, source in TEMPLATES.items():
+            template = compiled(source)
+            cases[f'render {name}'] = lambda template=template: template.render(context)
+            cases[f'render {name} limit 500'] = lambda template=template: template.render(context, 500)
+        
+        for name, function in cases.items():
+            print(f'{count:>10} {name:<28} {measure(function, number):>10.1f}')
+        print()
+
+
+if __name__ == '__main__':
+    main([int(count) for count in sys.argv[1:]] or [10, 100, 1000])
@@ -0,0 +1,68 @@
+'''Measures the cost of serializing, writing and reading a user with a large activity history.
+
+usage: python -m benchmarks.serialize [sizes...]'''
+
+import json, sys, tempfile, timeit
+from dataclasses import asdict, field
+from typing import Any, Callable
+
+import codec
+from jsondata import JSONData
+from storage import FileStorage
+
+
+class BenchUser(JSONData):
+    active: bool = True
+    strava_refresh_token: str = 'a' * 40
+    strava_access_token: str = 'b' * 40
+    strava_expires_at: float = 1700000000
+    activities: list[int] = field(default_factory=list[int])
+    spotify_refresh_token: str = 'c' * 130
+    spotify_access_token: str = 'd' * 200
+    spotify_expires_at: float = 1700000000
+
+
+def measure(function: Callable[[], Any], number: int) -> float:
+    '''Returns the best time per call in microseconds.'''
+    
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def main(sizes: list[int]):
+    orjson = codec.orjson
+    folder = tempfile.mkdtemp()
+    pretty = FileStorage()
+    compact = FileStorage(indent=None)
+    
+    print(f'{"activities":>10} {"case":<28} {"us/call":>10}')
+    for size in sizes:
+        user = BenchUser().set(activities=list(range(10**9, 10**9 + size)))
+        number = max(10, 100000 // (size + 100))
+        
+        cases = {
+            'asdict + json (before)': lambda: json.dumps(user, default=asdict, indent=4),
+            'to_dict + dumps indent': lambda: codec.dumps(user.to_dict(), indent=4),
+            'to_dict + dumps compact': lambda: codec.dumps(user.to_dict()),
+            'file write indent': lambda: pretty.save(folder, 'user', user.to_dict()),
+            'file write compact': lambda: compact.save(folder, 'user', user.to_dict()),
+            'file read': lambda: pretty.load(folder, 'user'),
+            'file read + activities': lambda: codec.parsed((pretty.load(folder, 'user') or {})['activities'])
+        }
+        
+        # the codec looks orjson up at call time, so it can be switched off for comparison
+        codec.orjson = None
+        for name, function in cases.items():
+            print(f'{size:>10} {name:<28} {measure(function, number):>10.1f}')
+        
+        if orjson is not None:
+            codec.orjson = orjson
+            for name, function in cases.items():
+                if 'before' not in name:
+                    print(f'{size:>10} {name + " (orjson)":<28} {measure(function, number):>10.1f}')
+        
+        codec.orjson = orjson
+        print()
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [100, 1000, 10000])
@@ -0,0 +1,106 @@
+import time
+from typing import Any, Callable, cast
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry # type: ignore # urllib3 1.x ships without type hints
+
+from constants import GOVERNOR_FOLDER, HTTP_BACKOFF, HTTP_POOL_SIZE, HTTP_RETRIES, HTTP_TIMEOUT, RATE_LIMIT_MAX_WAIT, RATE_LIMIT_RESERVE, SPOTIFY_API_URL, SPOTIFY_RATE_LIMIT, STRAVA_API_URL, STRAVA_RATE_LIMITS
+from governor import Governor
+from metrics import registry
+
+
+# requests which the api may have processed already are only retried if repeating them is harmless, unlike a token
+# refresh whose refresh token may have been rotated by the first attempt
+IDEMPOTENT_METHODS = frozenset({'HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'})
+
+
+class Client(requests.Session):
+    '''Session which keeps pooled connections to an api alive, paces requests with a governor and retries throttled or failed requests.'''
+    
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        governor: Governor | None = None,
+        pool_size: int = HTTP_POOL_SIZE,
+        timeout: float = HTTP_TIMEOUT,
+        retries: int = HTTP_RETRIES,
+        backoff: float = HTTP_BACKOFF
+    ):
+        super().__init__()
+        self.name = name
+        self.base_url = base_url
+        self.governor = governor
+        self.timeout = timeout
+        self.retries = retries
+        
+        # throttled requests are retried below so that the governor holds back every other caller as well
+        # the metaclass of urllib3 1.x hides the parameters of Retry from type checkers
+        retry = cast(Callable[..., Retry], Retry)(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504) if governor is None else (500, 502, 503, 504),
+            allowed_methods=IDEMPOTENT_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+    
+    
+    def request(self, method: str, url: str | bytes, *args: Any, **kwargs: Any) -> requests.Response: # type: ignore # narrower than the base signature
+        # relative urls are resolved against the api
+        if isinstance(url, str) and '://' not in url:
+            url = f'{self.base_url}/{url}'
+        
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.perf_counter()
+        try:
+            response = self._send(method, url, *args, **kwargs)
+        except requests.RequestException as e:
+            record(self.name, method, started, type(e).__name__)
+            raise
+        
+        record(self.name, method, started, response.status_code)
+        return response
+    
+    
+    def _send(self, method: str, url: str | bytes, *args: Any, **kwargs: Any) -> requests.Response:
+        if self.governor is None:
+            return super().request(method, url, *args, **kwargs)
+        
+        for _ in range(self.retries + 1):
+            self.governor.acquire()
+            response = super().request(method, url, *args, **kwargs)
+            self.governor.update(response)
+            if response.status_code != 429:
+                break
+        return response # type: ignore # there is always at least one attempt
+
+
+def record(api: str, method: str | bytes, started: float, status: int | str):
+    '''Records the latency and outcome of a request, including the time it waited for the rate limit and retries.'''
+    
+    method = method.decode() if isinstance(method, bytes) else method
+    registry.observe('http_request_seconds', time.perf_counter() - started, api=api, method=method.upper())
+    registry.increment('http_requests_total', api=api, status=str(status))
+    if not isinstance(status, int) or status >= 400:
+        registry.increment('http_errors_total', api=api, status=str(status))
+
+
+strava = Client('strava', STRAVA_API_URL, Governor(
+    'strava',
+    GOVERNOR_FOLDER,
+    [(15 * 60, STRAVA_RATE_LIMITS[0]), (24 * 60 * 60, STRAVA_RATE_LIMITS[1])],
+    RATE_LIMIT_RESERVE,
+    RATE_LIMIT_MAX_WAIT
+))
+spotify = Client('spotify', SPOTIFY_API_URL, Governor(
+    'spotify',
+    GOVERNOR_FOLDER,
+    [(30, SPOTIFY_RATE_LIMIT)] if SPOTIFY_RATE_LIMIT else [],
+    RATE_LIMIT_RESERVE,
+    RATE_LIMIT_MAX_WAIT
+))
@@ -0,0 +1,72 @@
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    # objects can describe their own json representation without being copied first
+    if hasattr(obj, '__json__'):
+        return obj.__json__()
+    
+    if isinstance(obj, (set, frozenset)):
+        return list(obj) # type: ignore # ehh
+    
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class Raw:
+    '''JSON which is only parsed once it is needed, and which can be written again as it is if it never was.'''
+    
+    __slots__ = ('data',)
+    
+    def __init__(self, data: bytes):
+        self.data = data
+    
+    
+    def load(self) -> Any:
+        return loads(self.data)
+    
+    
+    def __json__(self) -> Any:
+        return self.load()
+    
+    
+    def __repr__(self):
+        return f'Raw({len(self.data)} bytes)'
+
+
+def parsed(value: Any) -> Any:
+    '''Parses a value if it is still raw.'''
+    
+    return value.load() if isinstance(value, Raw) else value
+
+
+def dumps(data: Any, indent: int | None = None) -> bytes:
+    '''Serializes data to JSON bytes, using orjson when it's installed. Indented output is two spaces wide with orjson.'''
+    
+    if orjson is not None:
+        # dataclasses would otherwise be serialized with every attribute instead of their fields
+        option = orjson.OPT_PASSTHROUGH_DATACLASS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=option)
+    
+    separators = None if indent else (',', ':')
+    return json.dumps(data, default=_default, indent=indent, separators=separators).encode()
+
+
+def loads(data: bytes | str) -> Any:
+    '''Parses JSON, using orjson when it's installed.'''
+    
+    if orjson is not None:
+        return orjson.loads(data)
+    
+    return json.loads(data)
+
+
+# both parsers raise subclasses of this
+DecodeError = json.JSONDecodeError
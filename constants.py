@@ -4,7 +4,8 @@ from os import environ
 
 SECRET_KEY = b64encode(environ['SECRET_KEY'].encode())
 
-STRAVA_API_URL = 'https://www.strava.com/api/v3'
+# the apis can be pointed elsewhere, e.g. at the stand-ins of the load test
+STRAVA_API_URL = environ.get('STRAVA_API_URL', 'https://www.strava.com/api/v3')
 STRAVA_AUTH_URL = f'{STRAVA_API_URL}/oauth/authorize'
 STRAVA_TOKEN_URL = f'{STRAVA_API_URL}/oauth/token'
 
@@ -14,6 +15,86 @@ STRAVA_CLIENT_SECRET = environ['STRAVA_CLIENT_SECRET']
 SPOTIFY_CLIENT_ID = environ['SPOTIFY_CLIENT_ID']
 SPOTIFY_CLIENT_SECRET = environ['SPOTIFY_CLIENT_SECRET']
 
-SPOTIFY_API_URL = 'https://api.spotify.com/v1'
-SPOTIFY_AUTH_URL = 'https://accounts.spotify.com/authorize'
-SPOTIFY_TOKEN_URL = 'https://accounts.spotify.com/api/token'
+SPOTIFY_API_URL = environ.get('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
+SPOTIFY_ACCOUNTS_URL = environ.get('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com')
+SPOTIFY_AUTH_URL = f'{SPOTIFY_ACCOUNTS_URL}/authorize'
+SPOTIFY_TOKEN_URL = f'{SPOTIFY_ACCOUNTS_URL}/api/token'
+
+SERVER_NAME = environ.get('SERVER_NAME', 'spotipy.lalabuff.com')
+
+# oauth states expire after this many seconds, and this many used ones are remembered so they can't be used again
+STATE_TTL = 300
+STATE_CACHE_SIZE = 100000
+
+JOBS_FOLDER = 'data/jobs'
+WORKERS = int(environ.get('WORKERS', 4))
+# webhook events which were already received are remembered in this folder and in memory for this many seconds
+EVENTS_FOLDER = 'data/events'
+EVENT_TTL = float(environ.get('EVENT_TTL', 24 * 60 * 60))
+EVENT_CACHE_SIZE = int(environ.get('EVENT_CACHE_SIZE', 10000))
+
+# share of webhook events which are profiled, and how many seconds an event must take for its profile to be kept
+PROFILE_SAMPLE = float(environ.get('PROFILE_SAMPLE', 0))
+PROFILE_SLOW = float(environ.get('PROFILE_SLOW', 5))
+PROFILE_FOLDER = 'data/profiles'
+
+# how many events the asgi app handles at once, which mostly wait on the network
+ASYNC_WORKERS = int(environ.get('ASYNC_WORKERS', 100))
+
+# refresh access tokens this many seconds before they actually expire
+TOKEN_EXPIRY_MARGIN = 60
+
+HTTP_POOL_SIZE = int(environ.get('HTTP_POOL_SIZE', 10))
+HTTP_TIMEOUT = float(environ.get('HTTP_TIMEOUT', 10))
+HTTP_RETRIES = int(environ.get('HTTP_RETRIES', 3))
+HTTP_BACKOFF = float(environ.get('HTTP_BACKOFF', 0.5))
+
+# where the rate limit budgets shared by every process are kept
+GOVERNOR_FOLDER = 'data/governor'
+# strava's requests per 15 minutes and per day, until its headers say otherwise
+STRAVA_RATE_LIMITS = [int(limit) for limit in environ.get('STRAVA_RATE_LIMITS', '200,2000').split(',')]
+# spotify doesn't publish its limit, so requests per 30 seconds may be capped here, or 0 to only obey its 429s
+SPOTIFY_RATE_LIMIT = int(environ.get('SPOTIFY_RATE_LIMIT', 0))
+# share of every rate limit which background jobs leave to webhooks
+RATE_LIMIT_RESERVE = float(environ.get('RATE_LIMIT_RESERVE', 0.2))
+# longest a request waits for its rate limit before giving up
+RATE_LIMIT_MAX_WAIT = float(environ.get('RATE_LIMIT_MAX_WAIT', 900))
+
+# either `file` for one json file per object or `sqlite:///<path>` for a single database
+STORAGE = environ.get('STORAGE', 'file')
+
+# seconds between background writes of changed users, or 0 to write every change immediately
+FLUSH_INTERVAL = float(environ.get('FLUSH_INTERVAL', 0))
+# what happens to pending background writes: `exit`, `fsync` or `none`
+DURABILITY = environ.get('DURABILITY', 'exit')
+
+# how many users are kept in memory at once
+USER_CACHE_SIZE = int(environ.get('USER_CACHE_SIZE', 1000))
+
+# how many time windows of recently played tracks are remembered
+TRACK_CACHE_SIZE = int(environ.get('TRACK_CACHE_SIZE', 1000))
+
+# how many tracks are kept in memory at once, and for how many seconds their metadata is trusted
+METADATA_CACHE_SIZE = int(environ.get('METADATA_CACHE_SIZE', 10000))
+METADATA_TTL = float(environ.get('METADATA_TTL', 30 * 24 * 60 * 60))
+
+# whether the tempo of every track is fetched from spotify's audio features
+AUDIO_FEATURES = environ.get('AUDIO_FEATURES', '0') == '1'
+
+# how many of the most recent activities are remembered per user, or 0 for all of them
+ACTIVITY_RETENTION = int(environ.get('ACTIVITY_RETENTION', 0)) or None
+
+# whether several processes share the data folder, in which case users are locked and reloaded when changed elsewhere
+SHARED_DATA = environ.get('SHARED_DATA', '1') == '1'
+
+# whether user files are written without indentation, which is smaller and faster
+COMPACT_STORAGE = environ.get('COMPACT_STORAGE', '0') == '1'
+
+# whether changes to users' activities are appended to a journal instead of rewriting the whole user
+JOURNAL = environ.get('JOURNAL', '0') == '1'
+
+# the template of the music added to descriptions, unless a user has their own, see renderer.py for the sections
+DESCRIPTION_TEMPLATE = environ.get('DESCRIPTION_TEMPLATE', '🎵 Music Of The Activity 🎵\n{tracks}')
+
+# how many characters strava accepts in a description
+DESCRIPTION_LIMIT = int(environ.get('DESCRIPTION_LIMIT', 2000))
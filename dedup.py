@@ -0,0 +1,117 @@
+import os, threading, time, traceback
+from collections import OrderedDict
+from typing import Any
+
+
+class Deduplicator:
+    '''Remembers which webhook events have been seen during the last `ttl` seconds, so that redelivered events are only
+    handled once. Events are marked with an empty file each, which every process shares, and the most recent ones are
+    also kept in memory so that duplicates rarely touch the disk. Expired files are removed by a background thread.'''
+    
+    def __init__(self, folder: str, ttl: float = 24 * 60 * 60, capacity: int = 10000):
+        self.folder = folder
+        self.ttl = ttl
+        self.capacity = capacity
+        
+        self._seen: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # metrics
+        self.unique = 0
+        self.duplicates = 0
+        
+        thread = threading.Thread(target=self._loop, name='dedup-sweeper', daemon=True)
+        thread.start()
+    
+    
+    @staticmethod
+    def key(event: dict[str, Any]) -> str:
+        return f'{event.get("owner_id")}-{event.get("object_id")}-{event.get("aspect_type")}-{event.get("event_time")}'
+    
+    
+    def add(self, event: dict[str, Any]) -> bool:
+        '''Marks an event as seen, and returns whether it is the first time.'''
+        
+        key = self.key(event)
+        now = time.time()
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is not None and now - seen < self.ttl:
+                self.duplicates += 1
+                return False
+        
+        # creating the file is atomic, so only one process can see the event first
+        os.makedirs(self.folder, exist_ok=True)
+        path = f'{self.folder}/{key}'
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            first = True
+        except FileExistsError:
+            seen = os.stat(path).st_mtime
+            first = now - seen >= self.ttl
+            if first:
+                os.utime(path)
+            else:
+                now = seen
+        
+        with self._lock:
+            self._seen[key] = now
+            self._seen.move_to_end(key)
+            if len(self._seen) > self.capacity:
+                self._seen.popitem(last=False)
+            
+            if first:
+                self.unique += 1
+            else:
+                self.duplicates += 1
+        
+        return first
+    
+    
+    def discard(self, event: dict[str, Any]):
+        '''Forgets an event, e.g. because it couldn't be handled after all.'''
+        
+        key = self.key(event)
+        with self._lock:
+            self._seen.pop(key, None)
+        
+        try:
+            os.remove(f'{self.folder}/{key}')
+        except FileNotFoundError:
+            pass
+    
+    
+    def _sweep(self):
+        # expired events are removed so that the folder stays small
+        now = time.time()
+        try:
+            entries = os.scandir(self.folder)
+        except FileNotFoundError:
+            return
+        
+        with entries:
+            for entry in entries:
+                try:
+                    if now - entry.stat().st_mtime >= self.ttl:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+    
+    
+    def _loop(self):
+        while True:
+            time.sleep(min(self.ttl, 60))
+            try:
+                self._sweep()
+            except OSError:
+                traceback.print_exc()
+    
+    
+    def metrics(self) -> dict[str, int]:
+        '''Returns how many events were seen for the first time and how many were duplicates.'''
+        
+        return {
+            'size': len(self._seen),
+            'unique': self.unique,
+            'duplicates': self.duplicates
+        }
@@ -0,0 +1,173 @@
+import asyncio, time
+from typing import Any
+from weakref import WeakValueDictionary
+
+from constants import DESCRIPTION_LIMIT, DESCRIPTION_TEMPLATE, EVENT_CACHE_SIZE, EVENT_TTL, EVENTS_FOLDER, PROFILE_FOLDER, PROFILE_SAMPLE, PROFILE_SLOW
+from dedup import Deduplicator
+from metrics import profiled, span
+from renderer import Context, TemplateError, compiled
+from track import Track
+from tracks import PAGE_SIZE, aplayed, played, window
+from user import Revoked, User
+
+
+# strava redelivers events which weren't acknowledged in time
+seen = Deduplicator(EVENTS_FOLDER, EVENT_TTL, EVENT_CACHE_SIZE)
+
+# one lock per user so that events for the same user are handled one after another by the event loop, which is
+# forgotten once nobody holds or waits for it anymore
+_event_locks: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+
+
+def describe(user: User, activity: dict[str, Any], tracks: list[Track]) -> str:
+    '''Appends the music played during an activity to its description, within strava's length limit.'''
+    
+    try:
+        template = compiled(user.template or DESCRIPTION_TEMPLATE)
+    except TemplateError as e:
+        print(f'Invalid template of user {user.id}: {e}')
+        template = compiled(DESCRIPTION_TEMPLATE)
+    
+    old_description = activity.get('description') or ''
+    separator = '\n\n' if old_description else ''
+    music = template.render(Context(tracks, activity), DESCRIPTION_LIMIT - len(old_description) - len(separator))
+    return f'{old_description}{separator}{music}' if music else old_description
+
+
+def activity_key(event: dict[str, Any]) -> str:
+    '''Returns what events which should only be handled once at a time have in common.'''
+    
+    return f'{event["owner_id"]}/{event["object_id"]}'
+
+
+def write_description(user: User, activity_id: int, activity: dict[str, Any], items: list[dict[str, Any]]):
+    '''Appends the music to the description of an activity and remembers that it was handled.'''
+    
+    user.strava_request('PUT', f'activities/{activity_id}', {
+        'description': describe(user, activity, Track.played(user, items))
+    })
+    user.activities.add(activity_id)
+
+
+def remember(user: User, activity_id: int):
+    '''Remembers that an activity was described, unless another process already did.'''
+    
+    # a transaction reloads the user first if another process changed it, so the write can't conflict and be lost
+    with user.transaction():
+        if activity_id not in user.activities:
+            user.activities.add(activity_id)
+
+
+def accepted(event: dict[str, Any]) -> bool:
+    '''Checks whether a webhook event is one which is handled at all.'''
+    
+    return event.get('object_type') == 'activity' and event.get('aspect_type') == 'create' or deauthorized(event)
+
+
+def deauthorized(event: dict[str, Any]) -> bool:
+    '''Checks whether a webhook event says that an athlete revoked our access.'''
+    
+    authorized = event.get('updates', {}).get('authorized')
+    return event.get('object_type') == 'athlete' and event.get('aspect_type') == 'update' and str(authorized).lower() == 'false'
+
+
+def deauthorize(user: User):
+    '''Forgets the strava tokens of a user who revoked our access, and stops handling their events.'''
+    
+    with user.transaction():
+        user.set(active=False, strava_refresh_token='', strava_access_token='', strava_expires_at=0)
+
+
+def handle_event(event: dict[str, Any]):
+    '''Handles a webhook event which was accepted by the queue.'''
+    
+    try:
+        if deauthorized(event):
+            deauthorize(User(event['owner_id']))
+        else:
+            handle_activity(event)
+    except Revoked as e:
+        # the user was marked inactive, so there is nothing to retry
+        print(e)
+
+
+def handle_activity(event: dict[str, Any]):
+    '''Adds the recently played music to the description of a newly created activity.'''
+    
+    with profiled(activity_key(event).replace('/', '-'), PROFILE_FOLDER, PROFILE_SAMPLE, PROFILE_SLOW), span('event'):
+        user = User(event['owner_id'])
+        if not user.active:
+            return
+        
+        # make sure rotated tokens are written straight away
+        with span('refresh'):
+            user.refresh()
+        
+        # other workers can't handle the same activity while we hold the lock, and everything is written once at the end
+        with user.transaction():
+            activity_id = event['object_id']
+            with span('strava_get'):
+                activity = user.strava_request('GET', f'activities/{activity_id}')
+            
+            if activity_id not in user.activities:
+                with span('spotify_get'):
+                    items = played(user, *window(activity))
+                with span('strava_put'):
+                    write_description(user, activity_id, activity, items)
+
+
+async def ahandle_event(event: dict[str, Any]):
+    '''Same as `handle_event`, but asynchronous.'''
+    
+    try:
+        if deauthorized(event):
+            await asyncio.to_thread(deauthorize, User(event['owner_id']))
+        else:
+            with span('event'):
+                await ahandle_activity(event)
+    except Revoked as e:
+        print(e)
+
+
+async def ahandle_activity(event: dict[str, Any]):
+    '''Same as `handle_activity`, but asynchronous. Strava only sends the event once the activity is over, so the
+    activity and the music played before the event are fetched at the same time.'''
+    
+    user = User(event['owner_id'])
+    if not user.active:
+        return
+    
+    with span('refresh'):
+        await user.arefresh()
+    
+    activity_id = event['object_id']
+    async with _event_locks.setdefault(user.id, asyncio.Lock()):
+        # another process may have handled the activity already, and the check reads the disk
+        await asyncio.to_thread(user.revalidate)
+        if activity_id in user.activities:
+            return
+        
+        before = int(event.get('event_time', time.time()) * 1000)
+        with span('fetch'):
+            activity, history = await asyncio.gather(
+                user.astrava_request('GET', f'activities/{activity_id}'),
+                user.aspotify_request('GET', f'me/player/recently-played?limit={PAGE_SIZE}&before={before}')
+            )
+        with span('spotify_get'):
+            items = await aplayed(user, *window(activity), first=(history, before))
+        
+        # track metadata is cached on disk and rarely needs to be fetched, so it can do so on a thread
+        with span('strava_put'):
+            tracks = await asyncio.to_thread(Track.played, user, items)
+            
+            # the lock isn't held across processes while waiting for the apis, so check again right before writing
+            await asyncio.to_thread(user.revalidate)
+            if activity_id in user.activities:
+                return
+            
+            await user.astrava_request('PUT', f'activities/{activity_id}', {
+                'description': describe(user, activity, tracks)
+            })
+            
+            # writes wait for the disk and possibly other processes, which mustn't hold up the event loop
+            await asyncio.to_thread(remember, user, activity_id)
@@ -0,0 +1,233 @@
+import asyncio, fcntl, json, os, threading, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Generator, Literal, Mapping, Protocol
+
+
+Priority = Literal['live', 'background']
+
+# webhooks are live unless a job says otherwise, e.g. with `with background():`
+priority: ContextVar[Priority] = ContextVar('priority', default='live')
+
+
+@contextmanager
+def background():
+    '''Marks the calls made inside the block as background work, which yields to live work when the budget runs low.'''
+    
+    token = priority.set('background')
+    try:
+        yield
+    finally:
+        priority.reset(token)
+
+
+class Response(Protocol):
+    '''What the governor reads from the responses of requests and httpx alike.'''
+    
+    @property
+    def status_code(self) -> int: ...
+    
+    @property
+    def headers(self) -> Mapping[str, str]: ...
+
+
+class RateLimited(Exception):
+    '''Raised when a call would have to wait longer for the rate limit than it is allowed to.'''
+
+
+class Governor:
+    '''Token buckets for the calls to an api, which are refilled at fixed windows and shared by every process through a file.
+    
+    Each window is a period in seconds and the number of calls allowed in it, e.g. strava's 15 minutes and one day. The
+    buckets are corrected with the usage the api reports, and a 429 blocks every call until the api says to try again.'''
+    
+    def __init__(self, name: str, folder: str, windows: list[tuple[float, int]], reserve: float = 0.2, max_wait: float = 900):
+        self.name = name
+        self.path = f'{folder}/{name}.json'
+        self.windows = windows
+        self.reserve = reserve
+        self.max_wait = max_wait
+        
+        os.makedirs(folder, exist_ok=True)
+        
+        # background calls in this process give way while a live call is waiting
+        self._live = 0
+        self._lock = threading.Lock()
+        
+        # metrics
+        self.calls: dict[Priority, int] = {'live': 0, 'background': 0}
+        self.waits: dict[Priority, int] = {'live': 0, 'background': 0}
+        self.wait_total: dict[Priority, float] = {'live': 0.0, 'background': 0.0}
+        self.limited = 0
+        self.throttled = 0
+    
+    
+    def _default(self) -> dict[str, Any]:
+        return {
+            'windows': [{'limit': limit, 'usage': 0, 'reset': 0.0} for _, limit in self.windows],
+            'blocked_until': 0.0
+        }
+    
+    
+    @contextmanager
+    def _state(self) -> Generator[dict[str, Any], None, None]:
+        # the lock is released when the file is closed
+        with open(os.open(self.path, os.O_RDWR | os.O_CREAT), 'r+') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            
+            try:
+                state = json.load(file)
+                if len(state['windows']) != len(self.windows):
+                    raise ValueError('The windows have changed.')
+            except (ValueError, KeyError, TypeError):
+                state = self._default()
+            
+            # windows start over at multiples of their period, like strava's quarter hours and utc days
+            now = time.time()
+            for (period, _), window in zip(self.windows, state['windows']):
+                if window['reset'] <= now:
+                    window['usage'] = 0
+                    window['reset'] = (now // period + 1) * period
+            
+            yield state
+            
+            file.seek(0)
+            file.truncate()
+            json.dump(state, file)
+    
+    
+    def _take(self) -> float:
+        '''Takes a token from every bucket and returns 0, or returns how long to wait until that is possible with the
+        priority of the current context.'''
+        
+        live = priority.get() == 'live'
+        if not live and self._live:
+            return 0.1
+        
+        with self._state() as state:
+            now = time.time()
+            if state['blocked_until'] > now:
+                return state['blocked_until'] - now
+            
+            for window in state['windows']:
+                allowed = window['limit'] if live else int(window['limit'] * (1 - self.reserve))
+                if window['usage'] >= allowed:
+                    return window['reset'] - now
+            
+            for window in state['windows']:
+                window['usage'] += 1
+            return 0
+    
+    
+    @contextmanager
+    def _waiting(self) -> Generator[Callable[[float], float], None, None]:
+        '''Keeps track of a call while it waits for the rate limit. Yields a function which turns how long `_take` asks
+        to wait into how long to sleep before asking again, and raises RateLimited once the wait would be too long.'''
+        
+        kind = priority.get()
+        live = kind == 'live'
+        started = time.time()
+        
+        def pause(delay: float) -> float:
+            if time.time() + delay > started + self.max_wait:
+                with self._lock:
+                    self.limited += 1
+                raise RateLimited(f'The {self.name} rate limit is exhausted for another {delay:.0f} seconds.')
+            
+            # check again every now and then in case the api or another process freed up some budget
+            return min(delay, 1.0)
+        
+        if live:
+            with self._lock:
+                self._live += 1
+        try:
+            yield pause
+        finally:
+            if live:
+                with self._lock:
+                    self._live -= 1
+        
+        waited = time.time() - started
+        with self._lock:
+            self.calls[kind] += 1
+            if waited > 0.001:
+                self.waits[kind] += 1
+                self.wait_total[kind] += waited
+    
+    
+    def acquire(self):
+        '''Waits until a call may be made with the priority of the current context.'''
+        
+        with self._waiting() as pause:
+            while (delay := self._take()) > 0:
+                time.sleep(pause(delay))
+    
+    
+    async def aacquire(self):
+        '''Same as `acquire`, but without blocking the event loop. The state file is locked and read on a thread, since
+        another process may be holding it.'''
+        
+        with self._waiting() as pause:
+            while (delay := await asyncio.to_thread(self._take)) > 0:
+                await asyncio.sleep(pause(delay))
+    
+    
+    def update(self, response: Response):
+        '''Corrects the buckets with the rate limit headers of a response.'''
+        
+        limits = response.headers.get('X-RateLimit-Limit')
+        usages = response.headers.get('X-RateLimit-Usage')
+        throttled = response.status_code == 429
+        if not (limits and usages) and not throttled:
+            return
+        
+        with self._state() as state:
+            if limits and usages:
+                # other calls may still be in flight, so never count fewer calls than we know about
+                for window, limit, usage in zip(state['windows'], limits.split(','), usages.split(',')):
+                    window['limit'] = int(limit)
+                    window['usage'] = max(window['usage'], int(usage))
+            
+            if throttled:
+                # strava doesn't send Retry-After, but its usage headers already block until the window resets
+                try:
+                    retry_after = float(response.headers.get('Retry-After', 1))
+                except ValueError:
+                    retry_after = 1
+                state['blocked_until'] = max(state['blocked_until'], time.time() + retry_after)
+        
+        if throttled:
+            with self._lock:
+                self.throttled += 1
+    
+    
+    async def aupdate(self, response: Response):
+        '''Same as `update`, but the state file is locked and written on a thread.'''
+        
+        await asyncio.to_thread(self.update, response)
+    
+    
+    def metrics(self) -> dict[str, Any]:
+        '''Returns the remaining budget of every window and how long calls have waited for it.'''
+        
+        with self._state() as state:
+            now = time.time()
+            windows = [{
+                'period': period,
+                'limit': window['limit'],
+                'usage': window['usage'],
+                'remaining': max(window['limit'] - window['usage'], 0),
+                'reset_in': window['reset'] - now
+            } for (period, _), window in zip(self.windows, state['windows'])]
+            blocked_for = max(state['blocked_until'] - now, 0)
+        
+        with self._lock:
+            return {
+                'windows': windows,
+                'blocked_for': blocked_for,
+                'calls': dict(self.calls),
+                'waits': dict(self.waits),
+                'wait_avg': {kind: self.wait_total[kind] / (self.waits[kind] or 1) for kind in self.waits},
+                'throttled': self.throttled,
+                'limited': self.limited
+            }
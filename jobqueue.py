@@ -0,0 +1,239 @@
+import fcntl, json, os, threading, time, traceback
+from queue import Queue
+from typing import IO, Any, Callable
+from uuid import uuid4
+
+
+class JobQueue:
+    '''Durable job queue which persists pending jobs to disk and runs them on a pool of worker threads.
+    
+    Every queue keeps its jobs in a folder of its own, which it holds a lock on for as long as it runs. Queues which
+    start take over the jobs of the ones whose lock is free, i.e. whose process has died, by renaming the jobs into
+    their own folder, so jobs are never run by two live processes.'''
+    
+    def __init__(self, folder: str, handler: Callable[[dict[str, Any]], Any], workers: int = 4, attempts: int = 3):
+        self.root = folder
+        self.folder = f'{folder}/{os.getpid()}-{uuid4().hex[:8]}'
+        self.handler = handler
+        self.workers = workers
+        self.attempts = attempts
+        
+        self._queue: Queue[str] = Queue()
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        
+        # pending jobs by key, so that jobs for the same thing are only run once at a time, and the other way around
+        self._keys: dict[str, str] = {}
+        self._names: dict[str, str] = {}
+        self._owner: IO[str] | None = None
+        
+        # metrics
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+        self.latency_max = 0.0
+    
+    
+    def start(self):
+        '''Recovers jobs left over by processes which are no longer running and starts the workers.'''
+        
+        # the folder is only created once it is locked, so others can't mistake it for the folder of a dead process
+        os.makedirs(f'{self.root}/failed', exist_ok=True)
+        self._owner = open(f'{self.folder}.lock', 'w')
+        fcntl.flock(self._owner, fcntl.LOCK_EX)
+        os.makedirs(self.folder, exist_ok=True)
+        
+        # jobs used to be kept in the root folder itself
+        self._claim(self.root)
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.name == 'failed' or entry.path == self.folder:
+                continue
+            
+            with open(f'{entry.path}.lock', 'a') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # its process is still working on them
+                    continue
+                
+                self._claim(entry.path)
+                try:
+                    os.rmdir(entry.path)
+                    os.remove(f'{entry.path}.lock')
+                except OSError:
+                    pass
+        
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        
+        return self
+    
+    
+    def _claim(self, folder: str):
+        # another process may have claimed them already
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            return
+        
+        # job names start with their enqueue time, so sorting preserves order
+        for name in sorted(names):
+            if not name.endswith('.json'):
+                continue
+            
+            # renaming is atomic, so only one process can claim each job
+            try:
+                os.rename(f'{folder}/{name}', f'{self.folder}/{name}')
+            except FileNotFoundError:
+                continue
+            
+            try:
+                with open(f'{self.folder}/{name}', 'r') as file:
+                    key = json.load(file).get('key')
+            except (OSError, json.JSONDecodeError):
+                key = None
+            if key is not None:
+                with self._lock:
+                    self._keys[key] = name
+                    self._names[name] = key
+            self._queue.put(name)
+    
+    
+    def put(self, payload: dict[str, Any], key: str | None = None) -> str:
+        '''Persists a job to disk and schedules it to be run. If a job with the same key is still pending, no new job is
+        added and the name of the pending one is returned instead.'''
+        
+        name = f'{time.time_ns()}-{uuid4().hex}.json'
+        if key is not None:
+            with self._lock:
+                if key in self._keys:
+                    self.coalesced += 1
+                    return self._keys[key]
+                self._keys[key] = name
+                self._names[name] = key
+        
+        try:
+            self._write(name, {
+                'enqueued_at': time.time(),
+                'attempts': 0,
+                'key': key,
+                'payload': payload
+            })
+        except BaseException:
+            self._release(name)
+            raise
+        
+        self._queue.put(name)
+        return name
+    
+    
+    def _release(self, name: str):
+        with self._lock:
+            key = self._names.pop(name, None)
+            if key is not None and self._keys.get(key) == name:
+                del self._keys[key]
+    
+    
+    def _write(self, name: str, job: dict[str, Any]):
+        # write to a temporary file first so that a crash never leaves a partial job behind
+        path = f'{self.folder}/{name}'
+        temp = f'{path}.tmp'
+        with open(temp, 'w') as file:
+            json.dump(job, file)
+        os.replace(temp, path)
+    
+    
+    def _work(self):
+        while True:
+            name = self._queue.get()
+            try:
+                self._run(name)
+            except Exception:
+                # a worker must outlive any job, e.g. one whose file was removed
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+    
+    
+    def _run(self, name: str):
+        path = f'{self.folder}/{name}'
+        retried = False
+        try:
+            with open(path, 'r') as file:
+                job = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            traceback.print_exc()
+            self._release(name)
+            return
+        
+        started = time.time()
+        with self._lock:
+            self.running += 1
+        
+        try:
+            self.handler(job['payload'])
+        except Exception:
+            traceback.print_exc()
+            job['attempts'] += 1
+            if job['attempts'] < self.attempts:
+                # try again later
+                with self._lock:
+                    self.retried += 1
+                self._write(name, job)
+                self._queue.put(name)
+                retried = True
+            else:
+                with self._lock:
+                    self.failed += 1
+                os.replace(path, f'{self.root}/failed/{name}')
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            
+            finished = time.time()
+            latency = finished - job['enqueued_at']
+            with self._lock:
+                self.completed += 1
+                self.wait_total += started - job['enqueued_at']
+                self.run_total += finished - started
+                self.latency_max = max(self.latency_max, latency)
+        finally:
+            # the key stays taken only while the job is still queued
+            if not retried:
+                self._release(name)
+            with self._lock:
+                self.running -= 1
+    
+    
+    def depth(self) -> int:
+        '''Returns the number of jobs waiting to be run.'''
+        
+        return self._queue.qsize()
+    
+    
+    def metrics(self) -> dict[str, int | float]:
+        '''Returns queue depth and job latency statistics.'''
+        
+        with self._lock:
+            completed = self.completed or 1
+            return {
+                'depth': self.depth(),
+                'running': self.running,
+                'workers': self.workers,
+                'completed': self.completed,
+                'failed': self.failed,
+                'retried': self.retried,
+                'coalesced': self.coalesced,
+                'wait_avg': self.wait_total / completed,
+                'run_avg': self.run_total / completed,
+                'latency_avg': (self.wait_total + self.run_total) / completed,
+                'latency_max': self.latency_max
+            }
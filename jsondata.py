@@ -1,19 +1,33 @@
-import json, os
+import atexit, builtins, threading, time, traceback
 from abc import ABC
-from dataclasses import MISSING, Field, asdict, dataclass, fields
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from dataclasses import MISSING, Field, dataclass, fields
 from functools import wraps
 
 from types import GenericAlias
-from typing import TYPE_CHECKING, Any, Callable, ClassVar, Iterable, Literal, TypeAlias, TypeGuard, TypeVar, Union, cast
+from typing import TYPE_CHECKING, Any, Callable, ClassVar, Generator, Hashable, Iterable, Iterator, Literal, TypeAlias, TypeGuard, TypeVar, Union, cast, get_origin
+from weakref import WeakValueDictionary
 
 if TYPE_CHECKING:
     from _typeshed import SupportsRichComparison
 else:
     SupportsRichComparison = Any
 
+import codec
+from metrics import span
+from storage import FileStorage, Storage
+
 
 T = TypeVar('T')
-Bindable: TypeAlias = Union['JSONData', 'JSONData.AutoList[Any]', 'JSONData.AutoDict[Any]']
+J = TypeVar('J', bound='JSONData')
+Bindable: TypeAlias = Union['JSONData', 'JSONData.AutoList[Any]', 'JSONData.AutoDict[Any]', 'JSONData.AutoSet[Any]']
+Binder: TypeAlias = Callable[[Any, Bindable], Any]
+Durability: TypeAlias = Literal['exit', 'fsync', 'none']
+
+PRIMITIVES = (str, int, float, bool, type(None))
+
+DEFAULT_STORAGE = FileStorage()
 
 
 def _updater(func: Callable[..., T]) -> Callable[..., T]:
@@ -26,6 +40,26 @@ def _updater(func: Callable[..., T]) -> Callable[..., T]:
     return wrapper
 
 
+def _journaled(op: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        @wraps(func)
+        def wrapper(self: 'JSONData.AutoList[Any] | JSONData.AutoDict[Any]', *args: Any, suppress: bool = False, **kwargs: Any) -> T:
+            result = func(self, *args, **kwargs)
+            if not suppress:
+                _journal(self, op, *args)
+            return result
+        return wrapper
+    return decorator
+
+
+def _journal(container: 'JSONData.AutoList[Any] | JSONData.AutoDict[Any] | JSONData.AutoSet[Any]', op: str, *args: Any):
+    # only mutations of the fields themselves can be journaled, deeper ones rewrite the whole object
+    if isinstance(container.obj, JSONData) and container.key is not None:
+        container.obj.journal(op, container.key, *args)
+    else:
+        container.update()
+
+
 def isjsondata(hint: type | GenericAlias | None) -> TypeGuard[type['JSONData']]:
     if hint is None:
         return False
@@ -33,61 +67,458 @@ def isjsondata(hint: type | GenericAlias | None) -> TypeGuard[type['JSONData']]:
     if isinstance(hint, GenericAlias):
         return False
     
-    if isinstance(hint, type(Literal['a', 'b'])):
+    if get_origin(hint) is Literal:
         return False
     
     return issubclass(hint, JSONData)
 
 
+def isprimitive(hint: type | GenericAlias | None) -> bool:
+    '''Checks whether values of a type hint are stored as they are, without being bound.'''
+    
+    return hint in PRIMITIVES or get_origin(hint) is Literal
+
+
+def compile_binder(hint: type | GenericAlias | None, retention: int | None = None) -> Binder:
+    '''Builds a function which binds values of a type hint, so that the hint only needs to be inspected once.'''
+    
+    if isprimitive(hint):
+        def bind_primitive(value: Any, obj: Bindable) -> Any:
+            # anything unexpected still goes through the generic path
+            if type(value) in PRIMITIVES:
+                return value
+            return JSONData.bind(value, obj, hint=hint)
+        
+        return bind_primitive
+    
+    if isinstance(hint, GenericAlias) and hint.__origin__ is set:
+        subhint = hint.__args__[0]
+        
+        def bind_set(value: Any, obj: Bindable) -> Any:
+            if not isinstance(value, (list, set, frozenset)):
+                return JSONData.bind(value, obj, hint=hint)
+            
+            # sets can be configured to only keep their most recent elements
+            autoset = JSONData.AutoSet.from_iterable(cast(Iterable[Any], value), obj, hint=subhint)
+            autoset.retain(retention)
+            return autoset
+        
+        return bind_set
+    
+    def bind_generic(value: Any, obj: Bindable) -> Any:
+        return JSONData.bind(value, obj, hint=hint)
+    
+    return bind_generic
+
+
+class ConflictError(Exception):
+    '''Raised when an object is written after another process has changed its stored version.'''
+
+
+class Flusher:
+    '''Writes dirty objects in the background, at most once per interval each.
+    
+    Durability decides what happens to writes which are still pending: `exit` flushes them when the process exits,
+    `fsync` additionally waits for every write to reach the disk, and `none` gives no guarantees at all.'''
+    
+    def __init__(self, interval: float, durability: Durability = 'exit'):
+        self.interval = interval
+        self.durability = durability
+        self._lock = threading.Lock()
+        self._dirty: dict[int, JSONData] = {}
+        
+        thread = threading.Thread(target=self._loop, name='jsondata-flusher', daemon=True)
+        thread.start()
+        if durability != 'none':
+            atexit.register(self.flush)
+    
+    
+    def mark(self, obj: 'JSONData'):
+        '''Schedules an object to be written on the next flush.'''
+        
+        with self._lock:
+            self._dirty[id(obj)] = obj
+    
+    
+    def flush(self):
+        '''Writes every dirty object once.'''
+        
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        
+        storages: set[Storage] = set()
+        for obj in dirty.values():
+            try:
+                obj.flush()
+            except ConflictError:
+                traceback.print_exc()
+            storages.add(obj.STORAGE)
+        
+        # lets the backends commit the writes they batched
+        for storage in storages:
+            storage.flush()
+    
+    
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+class IdentityMap:
+    '''Cache of loaded objects by id which evicts the least recently used ones beyond its capacity, as well as the ones
+    which haven't been used for `ttl` seconds. Objects are flushed before they are evicted, and evicted objects which
+    are still referenced elsewhere keep being returned, so that there is never more than one instance per id.'''
+    
+    def __init__(self, capacity: int | None = None, ttl: float | None = None):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._objects: OrderedDict[str, tuple['JSONData', float]] = OrderedDict()
+        self._evicted: WeakValueDictionary[str, JSONData] = WeakValueDictionary()
+        
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    
+    def get(self, id: str) -> 'JSONData | None':
+        '''Returns the cached object with the given id, if any, and marks it as recently used.'''
+        
+        now = time.monotonic()
+        expired: list[JSONData] = []
+        with self._lock:
+            entry = self._objects.get(id)
+            if entry is not None and self.ttl is not None and now - entry[1] > self.ttl:
+                expired.append(self._evict(id))
+                entry = None
+            
+            if entry is not None:
+                self.hits += 1
+                self._objects[id] = (entry[0], now)
+                self._objects.move_to_end(id)
+                return entry[0]
+        
+        # an expired object is only returned again if something else still holds on to it
+        self._flush(expired)
+        expired.clear()
+        
+        with self._lock:
+            obj = self._evicted.get(id)
+            if obj is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return obj
+    
+    
+    def put(self, id: str, obj: 'JSONData'):
+        '''Caches an object, evicting others if the cache is full.'''
+        
+        now = time.monotonic()
+        evicted: list[JSONData] = []
+        with self._lock:
+            self._evicted.pop(id, None)
+            self._objects[id] = (obj, now)
+            self._objects.move_to_end(id)
+            
+            # the oldest entries are at the front
+            while self._objects:
+                oldest, (_, used) = next(iter(self._objects.items()))
+                full = self.capacity is not None and len(self._objects) > self.capacity
+                stale = self.ttl is not None and now - used > self.ttl
+                if not full and not stale:
+                    break
+                
+                evicted.append(self._evict(oldest))
+        
+        self._flush(evicted)
+    
+    
+    def _evict(self, id: str) -> 'JSONData':
+        # workers may still be using the object, and loading it again would give them a second copy to write over
+        obj, _ = self._objects.pop(id)
+        self._evicted[id] = obj
+        self.evictions += 1
+        return obj
+    
+    
+    @staticmethod
+    def _flush(objects: list['JSONData']):
+        # writes happen outside of the lock, and their conflicts are none of the business of whoever caused the eviction
+        for obj in objects:
+            try:
+                obj.flush()
+            except ConflictError:
+                traceback.print_exc()
+    
+    
+    def __contains__(self, id: str) -> bool:
+        return id in self._objects
+    
+    
+    def __len__(self) -> int:
+        return len(self._objects)
+    
+    
+    def metrics(self) -> dict[str, int]:
+        '''Returns the cache size along with hit, miss and eviction counts.'''
+        
+        return {
+            'size': len(self._objects),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class Index:
+    '''Maps the ids of a folder's objects to the value of one of their fields, and keeps the reverse map in memory, so
+    objects can be found by value without loading every one of them. A key function may index something derived from
+    the field instead, like the size of a container.
+    
+    Changes are appended to the index's journal, which is compacted into a new snapshot once it grows too large, and
+    the changes of other processes are picked up whenever the stored version changes. Objects are indexed whenever they
+    are updated, so an index which was never stored is first built from every stored object.'''
+    
+    def __init__(
+        self,
+        storage: Storage,
+        folder: str,
+        field: str,
+        default: Callable[[], Any],
+        key: Callable[[Any], Hashable] | None = None,
+        journal_limit: int = 64 * 1024
+    ):
+        self.storage = storage
+        self.source = folder
+        self.folder = f'{folder}/.indexes'
+        self.field = field
+        self.default = default
+        self.key = key
+        self.journal_limit = journal_limit
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._version: Hashable = None
+        self._values: dict[str, Hashable] = {}
+        self._ids: dict[Hashable, set[str]] = {}
+    
+    
+    def value(self, value: Any) -> Hashable:
+        '''Returns the indexed value of a field's value.'''
+        
+        return self.key(codec.parsed(value)) if self.key is not None else value
+    
+    
+    @staticmethod
+    def matches(value: Hashable, condition: Any) -> bool:
+        '''Checks an indexed value against a condition, which is either a value or a predicate.'''
+        
+        return bool(condition(value)) if callable(condition) else value == condition
+    
+    
+    def ids(self, condition: Any) -> set[str]:
+        '''Returns the ids of the objects whose indexed value matches a condition.'''
+        
+        with self._lock:
+            self._read()
+            if callable(condition):
+                return {id for id, value in self._values.items() if condition(value)}
+            return set(self._ids.get(condition, ()))
+    
+    
+    def put(self, id: str, value: Any):
+        '''Indexes the current value of an object's field, which is only written if it changed.'''
+        
+        value = self.value(value)
+        with self._lock:
+            self._read()
+            if id in self._values and self._values[id] == value:
+                return
+            
+            with self.storage.lock(self.folder, self.field):
+                # another process may have changed the index in the meantime
+                self._load()
+                self._assign(id, value)
+                size = self.storage.append(self.folder, self.field, [{'op': 'setitem', 'field': 'values', 'args': [id, value]}])
+                if size >= self.journal_limit:
+                    self._version = self.storage.save(self.folder, self.field, {'values': self._values})
+                else:
+                    self._version = self.storage.version(self.folder, self.field)
+    
+    
+    def _assign(self, id: str, value: Hashable):
+        if id in self._values:
+            ids = self._ids[self._values[id]]
+            ids.discard(id)
+            if not ids:
+                del self._ids[self._values[id]]
+        
+        self._values[id] = value
+        self._ids.setdefault(value, set()).add(id)
+    
+    
+    def _read(self):
+        # building takes the storage lock, so that processes don't build the same index at once
+        if self._load():
+            return
+        
+        with self.storage.lock(self.folder, self.field):
+            if not self._load():
+                self._build()
+    
+    
+    def _load(self) -> bool:
+        # reading the version first means a concurrent write can only make the index look outdated
+        version = self.storage.version(self.folder, self.field)
+        if self._loaded and version == self._version:
+            return True
+        
+        data = self.storage.load(self.folder, self.field)
+        if data is None:
+            return False
+        
+        self._version = version
+        self._values = {}
+        self._ids = {}
+        values: dict[str, Hashable] = data.get('values') or {}
+        for id, value in values.items():
+            self._assign(id, value)
+        self._loaded = True
+        return True
+    
+    
+    def _build(self):
+        values: dict[str, Hashable] = {}
+        for id in self.storage.ids(self.source):
+            data = self.storage.load(self.source, id) or {}
+            values[id] = self.value(data[self.field] if self.field in data else self.default())
+        
+        self._version = self.storage.save(self.folder, self.field, {'values': values})
+        self._values = {}
+        self._ids = {}
+        for id, value in values.items():
+            self._assign(id, value)
+        self._loaded = True
+
+
 class JSONData(ABC):
     '''Represents a dataclass which links its fields to a JSON file.'''
     
     FOLDER: str | None
-    _instances: dict[str, 'JSONData']
+    STORAGE: Storage
+    SHARED: bool
+    JOURNAL: bool
+    JOURNAL_LIMIT: int
+    DURABILITY: Durability
+    _instances: IdentityMap
     _fields: dict[str, Field[Any]]
+    _binders: dict[str, Binder]
+    _lazy: frozenset[str]
+    _indexes: dict[str, Index]
+    _flusher: Flusher | None
     __dataclass_fields__: ClassVar[dict[str, Field[Any]]]
     
-    def __init_subclass__(cls, folder: str | None = None, **kwargs: Any):
+    def __init_subclass__(
+        cls,
+        folder: str | None = None,
+        storage: Storage | None = None,
+        flush_interval: float | None = None,
+        durability: Durability = 'exit',
+        capacity: int | None = None,
+        ttl: float | None = None,
+        shared: bool = False,
+        journal: bool = False,
+        journal_limit: int = 64 * 1024,
+        **kwargs: Any
+    ):
         super().__init_subclass__(**kwargs)
         
         # prevents inheritence issues
         cls = dataclass(init=False)(cls) # type: ignore # can't seem to properly handle @dataclass
         cls.FOLDER = folder
-        cls._instances = {}
+        cls.STORAGE = storage or DEFAULT_STORAGE
+        cls.SHARED = shared
+        cls.JOURNAL = journal
+        cls.JOURNAL_LIMIT = journal_limit
+        cls.DURABILITY = durability
+        cls._flusher = Flusher(flush_interval, durability) if flush_interval else None
+        cls._instances = IdentityMap(capacity, ttl)
         cls._fields = {field.name: field for field in fields(cls)} # type: ignore
+        
+        # postponed annotations would be strings, which aren't supported
+        hints = {name: cast(type | GenericAlias | None, field.type) for name, field in cls._fields.items()}
+        
+        # hints are compiled once here rather than inspected on every load
+        cls._binders = {
+            name: compile_binder(hints[name], field.metadata.get('retention'))
+            for name, field in cls._fields.items()
+        }
+        
+        # containers are only bound once they are accessed, so their class defaults must not hide them
+        cls._lazy = frozenset(name for name in cls._fields if not isprimitive(hints[name]))
+        for name in cls._lazy:
+            if name in cls.__dict__:
+                delattr(cls, name)
+        
+        # fields are indexed with `index=True`, or with a key function which derives the indexed value from them
+        cls._indexes = {}
+        for name, field in cls._fields.items():
+            index = field.metadata.get('index')
+            if not index:
+                continue
+            if folder is None:
+                raise TypeError(f'{cls.__name__}.{name} can only be indexed if {cls.__name__} has a folder.')
+            if not callable(index) and not isprimitive(hints[name]):
+                raise TypeError(f'{cls.__name__}.{name} needs a key function to be indexed.')
+            
+            default = field.default_factory if field.default_factory is not MISSING else lambda field=field: field.default
+            key = cast(Callable[[Any], Hashable], index) if callable(index) else None
+            cls._indexes[name] = Index(cls.STORAGE, folder, name, default, key, journal_limit)
     
     
-    def __new__(cls, id: str = ''):
-        # instances are cached by id
-        if id and id in cls._instances:
-            return cls._instances[id]
+    def __new__(cls: type[J], id: str | int = '') -> J:
+        # instances are cached by id, which may also be passed as an int
+        if id:
+            obj = cast(J | None, cls._instances.get(str(id)))
+            if obj is not None:
+                # another process may have changed the object since it was cached
+                obj.revalidate()
+                return obj
         
         # create a new instance and set its properties
-        obj = super().__new__(cls)
+        obj = object.__new__(cls)
         if id:
-            cls._instances[id] = obj
+            cls._instances.put(str(id), obj)
         return obj
     
     
-    def __init__(self, id: str = ''):
+    def __init__(self, id: str | int = ''):
         if getattr(self, '__inited__', False):
             return
         
-        self.id = id
-        
-        # load fields from json file, if it exists
-        data: dict[str, Any] = {}
-        if id:
-            self._path = f'{self.FOLDER}/{id}.json'
-            if os.path.exists(self._path):
-                with open(self._path, 'r') as file:
-                    try:
-                        data = json.load(file)
-                    except json.JSONDecodeError:
-                        pass
+        # the same instance is returned for ids passed as ints, so its id mustn't depend on who created it first
+        self.id = str(id)
+        self._batches = 0
+        self._dirty = False
+        self._mutex = threading.RLock()
+        self._holds = 0
+        self._version: Hashable = None
+        self._raw: dict[str, Any] = {}
+        self._records: list[dict[str, Any]] = []
+        
+        # load fields from storage, if they exist
+        self._stored = bool(id) and self.FOLDER is not None
+        if self._stored:
+            self.reload()
         else:
-            self._path = None
+            self._assign({})
         
+        self.__inited__ = True
+    
+    
+    def _assign(self, data: dict[str, Any]):
         for name, field in self._fields.items():
             value = None
             
@@ -99,18 +530,67 @@ class JSONData(ABC):
             elif field.default is not MISSING:
                 value = field.default
             
-            self.__setattr__(name, value, suppress=True)
+            # containers are kept as they are until they are first accessed
+            if name in self._lazy:
+                vars(self).pop(name, None)
+                self._raw[name] = value
+            else:
+                self.__setattr__(name, value, suppress=True)
+    
+    
+    def __getattr__(self, name: str) -> Any:
+        # only called for attributes which don't exist yet, such as containers which haven't been bound
+        raw: dict[str, Any] | None = vars(self).get('_raw')
+        if raw is None or name not in raw:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        
+        with self._mutex:
+            # another thread may have bound it in the meantime
+            if name in vars(self):
+                return vars(self)[name]
+            
+            # the storage may have left it unparsed as well
+            value = self._binders[name](codec.parsed(raw[name]), self)
+            if isinstance(value, (JSONData.AutoList, JSONData.AutoDict, JSONData.AutoSet)):
+                value.key = name
+            vars(self)[name] = value
+            del raw[name]
+            return cast(Any, value)
+    
+    
+    def reload(self):
+        '''Replaces this object's fields with the ones in storage, discarding unwritten changes.'''
+        
+        # reading the version first means a concurrent write can only make it look outdated, never up to date
+        self._version = self.STORAGE.version(cast(str, self.FOLDER), self.id)
+        self._assign(self.STORAGE.load(cast(str, self.FOLDER), self.id) or {})
+        self._dirty = False
+        self._records.clear()
+    
+    
+    def stale(self) -> bool:
+        '''Checks whether the stored object has been changed by someone else since it was loaded or written.'''
         
-        self.__inited__ = True
+        return self._stored and self.STORAGE.version(cast(str, self.FOLDER), self.id) != self._version
+    
+    
+    def revalidate(self):
+        '''Reloads shared objects which were changed by another process, unless they have unwritten changes of their own.'''
+        
+        if self.SHARED and not self._dirty and self.stale():
+            self.reload()
     
     
     def __setattr__(self, name: str, value: Any, *, suppress: bool = False):
         '''Binds objects and updates the linked JSON file.'''
         
         if name in self._fields:
-            field = self._fields[name]
+            value = self._binders[name](value, self)
+            self._raw.pop(name, None)
             
-            value = JSONData.bind(value, self, hint=field.type)
+            # lets the container journal its mutations
+            if isinstance(value, (JSONData.AutoList, JSONData.AutoDict, JSONData.AutoSet)):
+                value.key = name
         
         super().__setattr__(name, value)
         
@@ -140,19 +620,209 @@ class JSONData(ABC):
     
     
     def update(self) -> None:
-        '''Writes this object's fields to the linked JSON file.'''
+        '''Writes this object's fields to its storage backend, unless the write is deferred to a batch or flusher.'''
         
-        if self._path is not None:
-            with open(self._path, 'w') as file:
-                json.dump(self, file, default=asdict, indent=4)
+        if not self._stored:
+            return
+        
+        self._reindex()
+        self._dirty = True
+        if self._batches:
+            return
+        
+        if self._flusher is not None:
+            self._flusher.mark(self)
+        else:
+            self.flush()
     
     
-    def to_json(self) -> str:
-        return json.dumps(self, default=asdict, indent=4)
+    def flush(self, fsync: bool | None = None) -> None:
+        '''Immediately writes this object's fields to its storage backend if they have changed, waiting for them to
+        reach the disk if `fsync` is set or, by default, if the class's durability is `fsync`. Raises a ConflictError
+        for shared objects which were changed by another process in the meantime.'''
+        
+        if not self._stored or not self._dirty:
+            return
+        
+        if fsync is None:
+            fsync = self.DURABILITY == 'fsync'
+        
+        with self.locked() if self.SHARED else nullcontext():
+            if self.SHARED and self.stale():
+                raise self._conflict()
+            
+            self._dirty = False
+            self._records.clear()
+            with span('storage_write', kind=type(self).__name__):
+                self._version = self.STORAGE.save(cast(str, self.FOLDER), self.id, self.to_dict(), fsync=fsync)
+                
+                # other processes must be able to see the write by the time the lock is released, and a synced write
+                # is only durable once its directory is synced too
+                if self.SHARED or fsync:
+                    self.STORAGE.flush()
+    
+    
+    def _conflict(self) -> ConflictError:
+        # the changes are lost either way, and keeping them would keep the object from ever being reloaded
+        self.reload()
+        return ConflictError(f'{type(self).__name__} "{self.id}" was changed by another process.')
+    
+    
+    def journal(self, op: str, field: str, *args: Any):
+        '''Records a mutation of one of this object's containers, which is much cheaper to write than the whole object.
+        Objects which don't keep a journal are written in full instead.'''
+        
+        if not self.JOURNAL or not self._stored:
+            self.update()
+            return
+        
+        self._reindex()
+        self._records.append({'op': op, 'field': field, 'args': list(args)})
+        if not self._batches:
+            self._append()
+    
+    
+    def _append(self):
+        records, self._records = self._records, []
+        
+        # a pending snapshot will contain these changes anyway
+        if not records or self._dirty:
+            return
+        
+        with self.locked() if self.SHARED else nullcontext():
+            if self.SHARED and self.stale():
+                raise self._conflict()
+            
+            with span('storage_append', kind=type(self).__name__):
+                fsync = self.DURABILITY == 'fsync'
+                size = self.STORAGE.append(cast(str, self.FOLDER), self.id, records, fsync=fsync)
+                if self.SHARED or fsync:
+                    self.STORAGE.flush()
+            self._version = self.STORAGE.version(cast(str, self.FOLDER), self.id)
+        
+        # the journal is compacted into a new snapshot once it grows too large, or periodically with a flusher
+        if size >= self.JOURNAL_LIMIT or self._flusher is not None:
+            self._dirty = True
+            self.update()
+    
+    
+    def _reindex(self):
+        if not self._indexes:
+            return
+        
+        data = self.to_dict()
+        for name, index in self._indexes.items():
+            index.put(self.id, data[name])
+    
+    
+    @classmethod
+    def cache_metrics(cls) -> dict[str, int]:
+        '''Returns the size of the cache of loaded objects along with its hit, miss and eviction counts.'''
+        
+        return cls._instances.metrics()
+    
+    
+    @classmethod
+    def ids(cls, **conditions: Any) -> list[str]:
+        '''Returns the ids of the stored objects whose indexed fields match every condition, without loading any of
+        them. A condition is either a value or a predicate of the indexed value. Without conditions, returns every id.'''
+        
+        if not conditions:
+            return list(cls.STORAGE.ids(cast(str, cls.FOLDER)))
+        
+        ids: set[str] | None = None
+        for name, condition in conditions.items():
+            if name not in cls._indexes:
+                raise KeyError(f'{cls.__name__}.{name} is not indexed.')
+            matches = cls._indexes[name].ids(condition)
+            ids = matches if ids is None else ids & matches
+        return sorted(cast(set[str], ids))
+    
+    
+    @classmethod
+    def where(cls: type[J], **conditions: Any) -> Iterator[J]:
+        '''Loads the objects which match every condition one at a time, like `ids`. Objects are checked again once they
+        are loaded, since they may have changed after their ids were looked up.'''
+        
+        for id in cls.ids(**conditions):
+            obj = cls(id)
+            data = obj.to_dict()
+            if all(Index.matches(obj._indexes[name].value(data[name]), condition) for name, condition in conditions.items()):
+                yield obj
+    
+    
+    @contextmanager
+    def locked(self) -> Generator['JSONData', None, None]:
+        '''Holds an exclusive lock on this object across threads and processes. The lock is reentrant.'''
+        
+        with self._mutex:
+            if self._holds:
+                self._holds += 1
+                try:
+                    yield self
+                finally:
+                    self._holds -= 1
+                return
+            
+            with self.STORAGE.lock(cast(str, self.FOLDER), self.id):
+                self._holds = 1
+                try:
+                    yield self
+                finally:
+                    self._holds = 0
+    
+    
+    @contextmanager
+    def transaction(self) -> Generator['JSONData', None, None]:
+        '''Locks this object, reloads it if another process has changed it, and writes every change made inside the
+        block before unlocking it again.'''
+        
+        if not self._stored:
+            with self.batch():
+                yield self
+            return
+        
+        with self.locked():
+            if self.stale():
+                self.reload()
+            
+            with self.batch():
+                yield self
+            self.flush()
+    
+    
+    @contextmanager
+    def batch(self) -> Generator['JSONData', None, None]:
+        '''Defers every update made inside the block to a single write at its end.'''
+        
+        self._batches += 1
+        try:
+            yield self
+        finally:
+            self._batches -= 1
+            if not self._batches:
+                if self._dirty:
+                    self.update()
+                else:
+                    self._append()
+    
+    
+    def to_json(self, indent: int | None = 4) -> str:
+        return codec.dumps(self.to_dict(), indent=indent).decode()
     
     
     def to_dict(self) -> dict[str, Any]:
-        return json.loads(self.to_json())
+        '''Returns this object's fields without copying them, so nested values are shared with the object.'''
+        
+        values = self.__dict__
+        raw = self._raw
+        
+        # containers which were never accessed are still in their json form, or even unparsed
+        return {name: values[name] if name in values else raw[name] for name in self._fields}
+    
+    
+    def __json__(self) -> dict[str, Any]:
+        return self.to_dict()
     
     
     @staticmethod
@@ -162,7 +832,7 @@ class JSONData(ABC):
         # we rebuild a deep copy of json dataclass
         if isinstance(value, JSONData):
             hint = type(value)
-            value = asdict(value)
+            value = value.to_dict()
         
         
         # do NOT make this an elif
@@ -185,6 +855,11 @@ class JSONData(ABC):
                 value = cast(dict[str, Any], value) # ehh
                 value = JSONData.AutoDict.from_dict(value, obj, hint=subhint)
         
+        # sets are stored as lists, so both can be interpreted as sets
+        elif isinstance(hint, GenericAlias) and hint.__origin__ is set and isinstance(value, (list, set, frozenset)):
+            value = cast(Iterable[Any], value) # ehh
+            value = JSONData.AutoSet.from_iterable(value, obj, hint=hint.__args__[0])
+        
         # this SHOULD be an elif
         elif isinstance(value, list):
             subhint = hint.__args__[0] if isinstance(hint, GenericAlias) and hint.__origin__ is list else None
@@ -209,15 +884,16 @@ class JSONData(ABC):
             super().__init__(*args, **kwargs)
             self.obj: Bindable | None = None
             self.hint: type | GenericAlias | None = None
+            self.key: str | None = None
         
         
-        @_updater
+        @_journaled('setitem')
         def __setitem__(self, key: str, value: Any):
             value = JSONData.bind(value, self, hint=self.hint)
             super().__setitem__(key, value)
         
         
-        @_updater
+        @_journaled('delitem')
         def __delitem__(self, key: str):
             super().__delitem__(key)
         
@@ -260,11 +936,16 @@ class JSONData(ABC):
         
         
         @staticmethod
-        def from_dict(data: dict[str, T], obj: Bindable, hint: type | GenericAlias | None = None) -> 'JSONData.AutoDict[T]':
-            autodict: JSONData.AutoDict[T] = JSONData.AutoDict()
+        def from_dict(data: dict[str, Any], obj: Bindable, hint: type | GenericAlias | None = None) -> 'JSONData.AutoDict[Any]':
+            autodict: JSONData.AutoDict[Any] = JSONData.AutoDict()
             autodict.obj = obj
             autodict.hint = hint
             
+            # primitives don't need to be bound one by one
+            if isprimitive(hint):
+                super(JSONData.AutoDict, autodict).update(data)
+                return autodict
+            
             for key, value in data.items():
                 autodict.__setitem__(key, value, suppress=True)
             
@@ -283,6 +964,7 @@ class JSONData(ABC):
             super().__init__(*args, **kwargs)
             self.obj: Bindable | None = None
             self.hint: type | GenericAlias | None = None
+            self.key: str | None = None
         
         
         @_updater
@@ -302,7 +984,7 @@ class JSONData(ABC):
             return super().__iadd__(other)
         
         
-        @_updater
+        @_journaled('append')
         def append(self, value: T):
             value = JSONData.bind(value, self, hint=self.hint)
             super().append(value)
@@ -334,10 +1016,11 @@ class JSONData(ABC):
             super().reverse()
         
         
-        @_updater
-        def extend(self, lst: Iterable[T]):
+        def extend(self, lst: Iterable[T], suppress: bool = False):
             lst = [JSONData.bind(x, self, hint=self.hint) for x in lst]
             super().extend(lst)
+            if not suppress:
+                _journal(self, 'extend', lst)
         
         
         @_updater
@@ -351,11 +1034,16 @@ class JSONData(ABC):
         
         
         @staticmethod
-        def from_list(data: list[T], obj: Bindable, hint: type | GenericAlias | None = None) -> 'JSONData.AutoList[T]':
-            autolist: JSONData.AutoList[T] = JSONData.AutoList()
+        def from_list(data: list[Any], obj: Bindable, hint: type | GenericAlias | None = None) -> 'JSONData.AutoList[Any]':
+            autolist: JSONData.AutoList[Any] = JSONData.AutoList()
             autolist.obj = obj
             autolist.hint = hint
             
+            # primitives don't need to be bound one by one
+            if isprimitive(hint):
+                super(JSONData.AutoList, autolist).extend(data)
+                return autolist
+            
             for value in data:
                 autolist.append(value, suppress=True)
             
@@ -364,3 +1052,178 @@ class JSONData(ABC):
         
         def __repr__(self):
             return f'a{super().__repr__()}'
+    
+    
+    class AutoSet(builtins.set[T]): # the set method shadows the builtin in here
+        '''Set which automatically updates its containing object when modified. Optionally retains only its most recently
+        added elements.'''
+        
+        
+        def __init__(self, *args: Any, **kwargs: Any):
+            super().__init__(*args, **kwargs)
+            self.obj: Bindable | None = None
+            self.hint: type | GenericAlias | None = None
+            self.key: str | None = None
+            self.retention: int | None = None
+            self._order: dict[T, None] | None = None
+        
+        
+        def retain(self, retention: int | None):
+            '''Limits the set to its `retention` most recently added elements.'''
+            
+            self.retention = retention
+            if retention is None:
+                self._order = None
+                return
+            
+            if self._order is None:
+                self._order = dict.fromkeys(self)
+            self._trim()
+        
+        
+        def _trim(self) -> list[T]:
+            trimmed: list[T] = []
+            if self._order is None or self.retention is None:
+                return trimmed
+            
+            while len(self._order) > self.retention:
+                oldest = next(iter(self._order))
+                del self._order[oldest]
+                super().discard(oldest)
+                trimmed.append(oldest)
+            
+            return trimmed
+        
+        
+        def add(self, value: T, suppress: bool = False):
+            # adding an existing element changes nothing, so it isn't worth a write
+            if value in self:
+                return
+            
+            super().add(value)
+            trimmed: list[T] = []
+            if self._order is not None:
+                self._order[value] = None
+                trimmed = self._trim()
+            
+            if not suppress:
+                _journal(self, 'add', value)
+                for oldest in trimmed:
+                    _journal(self, 'discard', oldest)
+        
+        
+        def discard(self, value: T, suppress: bool = False): # type: ignore # only elements of the set can be in it
+            if value not in self:
+                return
+            
+            super().discard(value)
+            if self._order is not None:
+                self._order.pop(value, None)
+            
+            if not suppress:
+                _journal(self, 'discard', value)
+        
+        
+        @_journaled('discard')
+        def remove(self, value: T):
+            super().remove(value)
+            if self._order is not None:
+                del self._order[value]
+        
+        
+        @_updater
+        def pop(self):
+            value = super().pop()
+            if self._order is not None:
+                del self._order[value]
+            return value
+        
+        
+        @_updater
+        def clear(self):
+            super().clear()
+            if self._order is not None:
+                self._order.clear()
+        
+        
+        @_updater
+        def __ior__(self, other: Iterable[T]): # type: ignore # sets only accept other sets
+            for value in other:
+                self.add(value, suppress=True)
+            return self
+        
+        
+        @_updater
+        def __isub__(self, other: Iterable[T]): # type: ignore # sets only accept other sets
+            for value in other:
+                self.discard(value, suppress=True)
+            return self
+        
+        
+        @_updater
+        def __iand__(self, other: Iterable[T]): # type: ignore # sets only accept other sets
+            keep = builtins.set(other)
+            for value in [value for value in self if value not in keep]:
+                self.discard(value, suppress=True)
+            return self
+        
+        
+        @_updater
+        def __ixor__(self, other: Iterable[T]): # type: ignore # sets only accept other sets
+            # elements are toggled once each, in the order they are given, so retention keeps the newest ones
+            for value in dict.fromkeys(other):
+                if value in self:
+                    self.discard(value, suppress=True)
+                else:
+                    self.add(value, suppress=True)
+            return self
+        
+        
+        @_updater
+        def difference_update(self, *others: Iterable[T]):
+            for other in others:
+                self.__isub__(other, suppress=True)
+        
+        
+        @_updater
+        def intersection_update(self, *others: Iterable[T]):
+            for other in others:
+                self.__iand__(other, suppress=True)
+        
+        
+        @_updater
+        def symmetric_difference_update(self, other: Iterable[T]):
+            self.__ixor__(other, suppress=True)
+        
+        
+        def update(self, *others: Iterable[T]):
+            if others:
+                for other in others:
+                    self.__ior__(other, suppress=True)
+                self.update()
+                return
+            
+            if self.obj is not None:
+                self.obj.update()
+        
+        
+        @staticmethod
+        def from_iterable(data: Iterable[Any], obj: Bindable, hint: type | GenericAlias | None = None) -> 'JSONData.AutoSet[Any]':
+            autoset: JSONData.AutoSet[Any] = JSONData.AutoSet(data)
+            autoset.obj = obj
+            autoset.hint = hint
+            
+            # lists keep the order in which elements were added, which retention relies on
+            if isinstance(data, list):
+                autoset._order = dict.fromkeys(data)
+            
+            return autoset
+        
+        
+        def __json__(self) -> list[T]:
+            # json has no sets, and lists keep the order which retention relies on
+            return list(self._order if self._order is not None else self)
+        
+        
+        def __repr__(self):
+            return f'a{builtins.set(self)!r}'
@@ -0,0 +1,165 @@
+'''Counters, latency histograms and timing spans, which are rendered in the prometheus text format.'''
+
+import cProfile, math, os, random, threading, time
+from contextlib import contextmanager
+from typing import Any, Callable, Generator
+
+
+PREFIX = 'spotipy'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, math.inf)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    '''Counts observations into cumulative buckets, like a prometheus histogram.'''
+    
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+    
+    
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    '''Every metric of this process by name and labels, along with collectors of metrics which are kept elsewhere.'''
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[Labels, float]] = {}
+        self._histograms: dict[str, dict[Labels, Histogram]] = {}
+        self._collectors: dict[str, Callable[[], Any]] = {}
+    
+    
+    def increment(self, name: str, value: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counters = self._counters.setdefault(name, {})
+            counters[key] = counters.get(key, 0) + value
+    
+    
+    def observe(self, name: str, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histograms = self._histograms.setdefault(name, {})
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram()
+            histogram.observe(value)
+    
+    
+    def collect(self, name: str, collector: Callable[[], Any]):
+        '''Registers a function whose json-like result is rendered as gauges, e.g. the metrics of a queue or cache.'''
+        
+        self._collectors[name] = collector
+    
+    
+    def render(self) -> str:
+        '''Returns every metric in the prometheus text format.'''
+        
+        lines: list[str] = []
+        with self._lock:
+            for name, counters in sorted(self._counters.items()):
+                lines.append(f'# TYPE {PREFIX}_{name} counter')
+                for labels, value in counters.items():
+                    lines.append(f'{PREFIX}_{name}{_labels(labels)} {value:g}')
+            
+            for name, histograms in sorted(self._histograms.items()):
+                lines.append(f'# TYPE {PREFIX}_{name} histogram')
+                for labels, histogram in histograms.items():
+                    total = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        total += count
+                        le = '+Inf' if bound == math.inf else f'{bound:g}'
+                        lines.append(f'{PREFIX}_{name}_bucket{_labels(labels + (("le", le),))} {total}')
+                    lines.append(f'{PREFIX}_{name}_sum{_labels(labels)} {histogram.sum:g}')
+                    lines.append(f'{PREFIX}_{name}_count{_labels(labels)} {histogram.count}')
+        
+        # collectors may take locks of their own, so they run outside of ours
+        gauges: dict[str, list[tuple[Labels, float]]] = {}
+        for name, collector in sorted(self._collectors.items()):
+            _flatten(f'{PREFIX}_{name}', collector(), (), gauges)
+        for name, values in gauges.items():
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in values:
+                lines.append(f'{name}{_labels(labels)} {value:g}')
+        
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _flatten(name: str, value: Any, labels: Labels, gauges: dict[str, list[tuple[Labels, float]]]):
+    # nested keys become part of the name, and list items get an index label
+    if isinstance(value, bool):
+        gauges.setdefault(name, []).append((labels, float(value)))
+    elif isinstance(value, (int, float)):
+        gauges.setdefault(name, []).append((labels, value))
+    elif isinstance(value, dict):
+        for key, item in value.items(): # type: ignore
+            _flatten(f'{name}_{key}', item, labels, gauges)
+    elif isinstance(value, list):
+        for i, item in enumerate(value): # type: ignore
+            _flatten(name, item, labels + (('index', str(i)),), gauges)
+
+
+registry = Registry()
+
+
+@contextmanager
+def span(stage: str, **labels: str) -> Generator[None, None, None]:
+    '''Times a stage of the pipeline, counting the ones which fail.'''
+    
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        registry.increment('span_errors_total', 1, stage=stage, **labels)
+        raise
+    finally:
+        registry.observe('span_seconds', time.perf_counter() - started, stage=stage, **labels)
+
+
+# only one profiler can be active at a time
+_profiling = threading.Lock()
+
+
+@contextmanager
+def profiled(name: str, folder: str, sample: float, slow: float) -> Generator[None, None, None]:
+    '''Profiles a `sample` of the blocks, and keeps the profiles of the ones which take at least `slow` seconds in a
+    folder, where they can be read with pstats or snakeviz.'''
+    
+    if sample <= 0 or random.random() >= sample or not _profiling.acquire(blocking=False):
+        yield
+        return
+    
+    profile = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+        
+        elapsed = time.perf_counter() - started
+        if elapsed >= slow:
+            os.makedirs(folder, exist_ok=True)
+            profile.dump_stats(f'{folder}/{time.time_ns()}-{name}.prof')
+            registry.increment('profiles_total')
+    finally:
+        _profiling.release()
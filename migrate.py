@@ -0,0 +1,38 @@
+'''Copies every JSONData object in a folder from one storage backend to another.
+
+usage: python migrate.py data/users sqlite:///data/spotipy.db [--source file]'''
+
+from argparse import ArgumentParser
+
+from storage import open_storage
+
+
+def migrate(folder: str, source: str, destination: str) -> int:
+    src = open_storage(source)
+    dst = open_storage(destination)
+    if src is dst:
+        raise ValueError('The source and destination backends are the same.')
+    
+    count = 0
+    for id in src.ids(folder):
+        data = src.load(folder, id)
+        if data is None:
+            print(f'Skipping unreadable object "{id}".')
+            continue
+        
+        dst.save(folder, id, data)
+        count += 1
+    
+    dst.flush()
+    return count
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Copies every JSONData object in a folder from one storage backend to another.')
+    parser.add_argument('folder', help='folder of the objects, such as data/users')
+    parser.add_argument('destination', help='backend to copy into, such as sqlite:///data/spotipy.db')
+    parser.add_argument('--source', default='file', help='backend to copy from (default: file)')
+    args = parser.parse_args()
+    
+    count = migrate(args.folder, args.source, args.destination)
+    print(f'Migrated {count} objects from {args.source} to {args.destination}.')
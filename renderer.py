@@ -0,0 +1,173 @@
+'''Renders the descriptions of activities from templates, whose placeholders are filled in by sections such as the
+tracks which were played or the artists which were played most.
+
+Templates are plain text with section names in braces, e.g. `🎵 Music Of The Activity 🎵\n{tracks}\n{minutes}`, and
+literal braces are doubled. Every template is compiled once, and more sections can be added with `section`.'''
+
+import string
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable
+
+from track import Track
+
+
+# how many artists the top artists section lists
+TOP_ARTISTS = 3
+
+# appended to sections which had to be cut short, with the number of lines which were left out
+MORE = '…and {} more'
+
+
+class TemplateError(ValueError):
+    '''Raised for templates which can't be parsed or use sections which don't exist.'''
+
+
+@dataclass
+class Context:
+    '''Everything that sections can describe.'''
+    
+    tracks: list[Track]
+    activity: dict[str, Any] = field(default_factory=dict[str, Any])
+    
+    # link to a playlist of the tracks, if one was made
+    playlist: str | None = None
+
+
+Section = Callable[[Context], list[str]]
+
+SECTIONS: dict[str, Section] = {}
+
+# sections whose last lines are left out when a description is too long
+SHRINKABLE: set[str] = set()
+
+
+def section(name: str, shrinkable: bool = False) -> Callable[[Section], Section]:
+    '''Registers a function which renders a section as lines, of which there may be none.'''
+    
+    def decorator(function: Section) -> Section:
+        SECTIONS[name] = function
+        if shrinkable:
+            SHRINKABLE.add(name)
+        return function
+    return decorator
+
+
+@section('tracks', shrinkable=True)
+def tracks(context: Context) -> list[str]:
+    if not context.tracks:
+        return ['None :(']
+    
+    return [
+        f'{track.name} - {", ".join(track.artists)}{f" ({track.tempo:.0f} BPM)" if track.tempo else ""}'
+        for track in context.tracks
+    ]
+
+
+@section('top_artists')
+def top_artists(context: Context) -> list[str]:
+    counts = Counter(artist for track in context.tracks for artist in track.artists)
+    if not counts:
+        return []
+    return [f'Top artists: {", ".join(artist for artist, _ in counts.most_common(TOP_ARTISTS))}']
+
+
+@section('minutes')
+def minutes(context: Context) -> list[str]:
+    total = sum(track.duration_ms for track in context.tracks) / 60000
+    return [f'{total:.0f} minutes of music'] if total >= 0.5 else []
+
+
+@section('playlist')
+def playlist(context: Context) -> list[str]:
+    return [context.playlist] if context.playlist else []
+
+
+class Template:
+    '''A template which was parsed into the literal text and sections of each of its lines.'''
+    
+    def __init__(self, source: str):
+        self.source = source
+        self.lines: list[list[tuple[str, str | None]]] = []
+        self.sections: list[str] = []
+        
+        for line in source.split('\n'):
+            parts: list[tuple[str, str | None]] = []
+            try:
+                parsed = list(string.Formatter().parse(line))
+            except ValueError as e:
+                raise TemplateError(str(e)) from e
+            
+            for literal, name, spec, conversion in parsed:
+                if name is not None:
+                    if name not in SECTIONS:
+                        raise TemplateError(f'Unknown section "{name}".')
+                    if spec or conversion:
+                        raise TemplateError(f'Section "{name}" can\'t be formatted.')
+                    if name not in self.sections:
+                        self.sections.append(name)
+                parts.append((literal, name))
+            self.lines.append(parts)
+    
+    
+    def render(self, context: Context, limit: int | None = None) -> str:
+        '''Renders the template, leaving out the last lines of sections such as the tracks if it would be longer than
+        `limit`, and cutting it short if that isn't enough.'''
+        
+        rendered = {name: SECTIONS[name](context) for name in self.sections}
+        text = self._join(rendered)
+        if limit is None or len(text) <= limit:
+            return text
+        if limit <= 0:
+            return ''
+        
+        # later sections are shortened first
+        for name in reversed(self.sections):
+            if name not in SHRINKABLE or not rendered[name]:
+                continue
+            
+            lines = rendered[name]
+            overflow = len(text) - limit
+            saved = left_out = 0
+            for left_out in range(1, len(lines) + 1):
+                saved += len(lines[-left_out]) + 1
+                if saved - len(MORE.format(left_out)) - 1 >= overflow:
+                    break
+            
+            rendered[name] = [*lines[:-left_out], MORE.format(left_out)]
+            text = self._join(rendered)
+            if len(text) <= limit:
+                return text
+        
+        return text[:limit - 1] + '…'
+    
+    
+    def _join(self, rendered: dict[str, list[str]]) -> str:
+        lines: list[str] = []
+        for parts in self.lines:
+            chunks: list[str] = []
+            empty = True
+            for literal, name in parts:
+                chunks.append(literal)
+                if name is not None and rendered[name]:
+                    chunks.append('\n'.join(rendered[name]))
+                    empty = False
+            
+            # lines which only hold sections with nothing to say are left out entirely
+            if empty and parts and any(name is not None for _, name in parts) and not ''.join(chunks).strip():
+                continue
+            lines.append(''.join(chunks))
+        
+        return '\n'.join(lines)
+
+
+@lru_cache(maxsize=1024)
+def compiled(source: str) -> Template:
+    '''Returns the compiled template of a source, which is only parsed the first time.'''
+    
+    return Template(source)
+
+
+def render(source: str, context: Context, limit: int | None = None) -> str:
+    return compiled(source).render(context, limit)
@@ -1,29 +1,72 @@
-from os import urandom
-import time
+import secrets, threading, time
+from collections import OrderedDict
 
 import jwt
+from jwt.algorithms import HMACAlgorithm
 
-from constants import SECRET_KEY
+from constants import SECRET_KEY, STATE_CACHE_SIZE, STATE_TTL
+
+
+ALGORITHM = 'HS256'
+
+# derived once rather than on every token
+KEY = HMACAlgorithm(HMACAlgorithm.SHA256).prepare_key(SECRET_KEY)
+
+
+class InvalidState(ValueError):
+    '''Raised for state tokens which are malformed, expired or were already used.'''
+
+
+class NonceStore:
+    '''Remembers the nonces of used tokens until they expire, so that every token is only accepted once. Nonces are
+    kept in memory, so a token could still be used once per process.'''
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._nonces: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+    
+    
+    def use(self, nonce: str, expires_at: float) -> bool:
+        '''Marks a nonce as used, and returns whether it is the first time.'''
+        
+        now = time.time()
+        with self._lock:
+            # nonces are added in roughly the order they expire in, and expired tokens are rejected anyway
+            while self._nonces and (next(iter(self._nonces.values())) < now or len(self._nonces) >= self.capacity):
+                self._nonces.popitem(last=False)
+            
+            if nonce in self._nonces:
+                return False
+            self._nonces[nonce] = expires_at
+            return True
 
 
 DataT = str | bytes | int | float | bool | dict[str, 'DataT'] | list['DataT'] | tuple['DataT', ...]
 class JWT:
     _data: dict[str, DataT]
+    _nonces = NonceStore(STATE_CACHE_SIZE)
     
     def __init__(self, _token: str = ..., /, **kwargs: DataT):
         self._data = kwargs
-        self._data['__salt__'] = urandom(96).hex()
+        self._token: str | None = None
         if _token is not ...:
-            self._data.update(jwt.decode(_token, SECRET_KEY, ['HS256']))
-        if self.__time__:
-            if not isinstance(self.__time__, (int, float)):
-                raise ValueError(f'Invalid expiratinon time {self.__time__}.')
-            if time.time() > self.__time__:
-                raise ValueError(f'Token expired.')
+            # the signature and expiration are checked by pyjwt
+            try:
+                self._data.update(jwt.decode(_token, KEY, [ALGORITHM], options={'require': ['exp', 'n']}))
+            except jwt.InvalidTokenError as e:
+                raise InvalidState(str(e)) from e
+            
+            if not self._nonces.use(str(self._data['n']), float(self._data['exp'])): # type: ignore
+                raise InvalidState('Token was already used.')
     
     def __str__(self):
-        self._data['__time__'] = time.time() + 300
-        return jwt.encode(self._data, SECRET_KEY, 'HS256')
+        # the token is only signed once, and the salt keeps tokens with the same data apart
+        if self._token is None:
+            self._data.setdefault('n', secrets.token_urlsafe(6))
+            self._data.setdefault('exp', int(time.time() + STATE_TTL))
+            self._token = jwt.encode(self._data, KEY, ALGORITHM)
+        return self._token
     
     def __getitem__(self, key: str) -> DataT:
         return self._data[key]
@@ -0,0 +1,557 @@
+import atexit, fcntl, os, sqlite3, threading, time, zlib
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import cache
+from typing import Any, Generator, Hashable, Iterable, Iterator
+
+import codec
+
+
+PRIMITIVES = (str, int, float, bool, type(None))
+
+# the first key of sectioned files, which plain json files never start with
+SECTIONED = b'{"__sections__":'
+
+
+class Storage(ABC):
+    '''Backend which persists the fields of JSONData objects, grouped by folder and keyed by id.'''
+    
+    @abstractmethod
+    def load(self, folder: str, id: str) -> dict[str, Any] | None:
+        '''Returns the stored fields of an object, or None if it doesn't exist or can't be read.'''
+    
+    
+    @abstractmethod
+    def save(self, folder: str, id: str, data: dict[str, Any], fsync: bool = False) -> Hashable:
+        '''Stores the fields of an object, replacing any previous version, and returns the new version. With `fsync`,
+        only returns once the write is durable.'''
+    
+    
+    @abstractmethod
+    def version(self, folder: str, id: str) -> Hashable:
+        '''Returns a cheap token which changes whenever the stored object does, or None if it doesn't exist.'''
+    
+    
+    @abstractmethod
+    def ids(self, folder: str) -> Iterator[str]:
+        '''Yields the ids of every object stored in a folder.'''
+    
+    
+    @abstractmethod
+    def delete(self, folder: str, id: str) -> None:
+        '''Removes an object along with its journal, if it exists.'''
+    
+    
+    @abstractmethod
+    def append(self, folder: str, id: str, records: list[dict[str, Any]], fsync: bool = False) -> int:
+        '''Appends mutation records to the journal of an object, which are replayed on top of its last snapshot when it
+        is loaded, and returns the size of the journal in bytes. Saving a new snapshot clears the journal.'''
+    
+    
+    def flush(self) -> None:
+        '''Makes sure that every pending write has reached the backend.'''
+    
+    
+    @contextmanager
+    def lock(self, folder: str, id: str) -> Generator[None, None, None]:
+        '''Holds an exclusive advisory lock on an object, which is respected by every thread and process.'''
+        
+        os.makedirs(folder, exist_ok=True)
+        
+        # each call opens its own file description, so threads of the same process exclude each other too
+        with open(f'{folder}/{id}.lock', 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def replay(data: dict[str, Any], records: Iterable[dict[str, Any]]) -> dict[str, Any]:
+    '''Applies journaled mutations to the stored fields of an object.'''
+    
+    for record in records:
+        name, args = record['field'], record['args']
+        if name in data:
+            data[name] = codec.parsed(data[name])
+        
+        match record['op']:
+            case 'append' | 'add':
+                data[name] = data.get(name) or []
+                data[name].append(args[0])
+            case 'extend':
+                data[name] = data.get(name) or []
+                data[name].extend(args[0])
+            case 'discard':
+                values: list[Any] = data.get(name) or []
+                if args[0] in values:
+                    values.remove(args[0])
+            case 'setitem':
+                data[name] = data.get(name) or {}
+                data[name][args[0]] = args[1]
+            case 'delitem':
+                items: dict[str, Any] = data.get(name) or {}
+                items.pop(args[0], None)
+            case op:
+                raise ValueError(f'Unknown journal operation "{op}".')
+    
+    return data
+
+
+class FileStorage(Storage):
+    '''Stores every object as its own JSON file, named after its id.
+    
+    Files are replaced atomically and end with a checksum line, so readers never see a partial write. The previous
+    version of each file is kept as a backup generation which is read instead whenever the current one is corrupt.
+    
+    Journals are kept next to the snapshots as JSON lines. Every snapshot has a random generation which its journal
+    records are tagged with, so records left over from before a snapshot are never replayed twice.
+    
+    Containers are written as sections after a single line header with the other fields and the offsets of the
+    sections. Only the header is parsed on load, and the sections are loaded as raw JSON which is parsed once it is
+    needed, so checking a token doesn't parse a long activity history. Sections which were never parsed are written
+    back as they are.'''
+    
+    def __init__(self, indent: int | None = 4, backups: bool = True):
+        self.indent = indent
+        self.backups = backups
+        self._folders: set[str] = set()
+        self._unsynced: set[str] = set()
+        self._lock = threading.Lock()
+    
+    
+    def path(self, folder: str, id: str) -> str:
+        return f'{folder}/{id}.json'
+    
+    
+    def journal_path(self, folder: str, id: str) -> str:
+        return f'{folder}/{id}.journal'
+    
+    
+    def load(self, folder: str, id: str) -> dict[str, Any] | None:
+        data = self._snapshot(folder, id)
+        generation = data.pop('__generation__', None) if data is not None else None
+        
+        records = self._records(folder, id, generation)
+        if records:
+            data = replay(data or {}, records)
+        return data
+    
+    
+    def _snapshot(self, folder: str, id: str) -> dict[str, Any] | None:
+        path = self.path(folder, id)
+        data = self._read(path)
+        if data is None and self.backups:
+            data = self._read(f'{path}.bak')
+        return data
+    
+    
+    def _records(self, folder: str, id: str, generation: str | None) -> list[dict[str, Any]]:
+        path = self.journal_path(folder, id)
+        try:
+            with open(path, 'rb') as file:
+                content = file.read()
+        except FileNotFoundError:
+            return []
+        
+        # a record cut off by a crash has no newline yet, and is left for the next append to remove
+        records: list[dict[str, Any]] = []
+        for line in content.split(b'\n')[:-1]:
+            try:
+                record = codec.loads(line)
+            except (codec.DecodeError, UnicodeDecodeError):
+                break
+            
+            if record.get('g') == generation:
+                records.append(record)
+        
+        return records
+    
+    
+    def _read(self, path: str) -> dict[str, Any] | None:
+        try:
+            with open(path, 'rb') as file:
+                content = file.read()
+        except FileNotFoundError:
+            return None
+        
+        # files written before checksums were introduced are plain json
+        payload, separator, checksum = content.rpartition(b'\n#')
+        if separator:
+            if checksum.strip() != self._checksum(payload):
+                return None
+        else:
+            payload = content
+        
+        try:
+            if not payload.startswith(SECTIONED):
+                return codec.loads(payload)
+            
+            # objects without containers have no sections after their header
+            end = payload.find(b'\n')
+            if end < 0:
+                end = len(payload)
+            data = codec.loads(payload[:end])
+            for name, (start, length) in data.pop('__sections__').items():
+                data[name] = codec.Raw(payload[end + 1 + start:end + 1 + start + length])
+            return data
+        except (codec.DecodeError, UnicodeDecodeError, ValueError):
+            return None
+    
+    
+    def _dumps(self, data: dict[str, Any]) -> bytes:
+        header: dict[str, Any] = {'__sections__': {}}
+        sections: list[bytes] = []
+        offset = 0
+        for name, value in data.items():
+            if isinstance(value, PRIMITIVES):
+                header[name] = value
+                continue
+            
+            section = value.data if isinstance(value, codec.Raw) else codec.dumps(value, indent=self.indent)
+            header['__sections__'][name] = [offset, len(section)]
+            sections.append(section)
+            offset += len(section) + 1
+        
+        # compact json never contains a newline, so the header ends at the first one
+        return b'\n'.join([codec.dumps(header), *sections])
+    
+    
+    @staticmethod
+    def _checksum(payload: bytes) -> bytes:
+        return b'%08x' % zlib.crc32(payload)
+    
+    
+    def save(self, folder: str, id: str, data: dict[str, Any], fsync: bool = False) -> Hashable:
+        if folder not in self._folders:
+            os.makedirs(folder, exist_ok=True)
+            self._folders.add(folder)
+        
+        generation = os.urandom(6).hex()
+        payload = self._dumps({**data, '__generation__': generation})
+        path = self.path(folder, id)
+        
+        # every writer gets its own temporary file, so concurrent writes don't need a lock
+        suffix = f'{os.getpid()}.{threading.get_ident()}.tmp'
+        temp = f'{path}.{suffix}'
+        with open(temp, 'wb') as file:
+            file.write(payload + b'\n#' + self._checksum(payload) + b'\n')
+            file.flush()
+            if fsync:
+                os.fsync(file.fileno())
+            
+            # the file keeps its inode when it is renamed
+            version = (*self._version(os.fstat(file.fileno())), 0)
+        
+        # keep the current version around without ever leaving the path empty
+        if self.backups:
+            try:
+                os.link(path, f'{path}.bak.{suffix}')
+                os.replace(f'{path}.bak.{suffix}', f'{path}.bak')
+            except FileNotFoundError:
+                pass
+        
+        os.replace(temp, path)
+        
+        # the snapshot has a new generation, so the journal is obsolete even if removing it fails
+        try:
+            os.remove(self.journal_path(folder, id))
+        except FileNotFoundError:
+            pass
+        
+        # the renames only become durable once the directory is synced, which is batched until the next flush
+        if fsync:
+            with self._lock:
+                self._unsynced.add(folder)
+        
+        return version
+    
+    
+    def version(self, folder: str, id: str) -> Hashable:
+        try:
+            journal = os.stat(self.journal_path(folder, id)).st_size
+        except FileNotFoundError:
+            journal = 0
+        
+        try:
+            return (*self._version(os.stat(self.path(folder, id))), journal)
+        except FileNotFoundError:
+            return (None, journal) if journal else None
+    
+    
+    @staticmethod
+    def _version(stat: os.stat_result) -> tuple[int, int, int]:
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    
+    def append(self, folder: str, id: str, records: list[dict[str, Any]], fsync: bool = False) -> int:
+        # the generation is read from the snapshot rather than remembered for every object, which appends can do since
+        # they are made under the object's lock, so the snapshot can't change in the meantime
+        data = self._snapshot(folder, id)
+        generation = data.get('__generation__') if data is not None else None
+        
+        if folder not in self._folders:
+            os.makedirs(folder, exist_ok=True)
+            self._folders.add(folder)
+        
+        # a single write of a few lines is appended atomically
+        lines = b''.join(codec.dumps({'g': generation, **record}) + b'\n' for record in records)
+        with open(self.journal_path(folder, id), 'a+b') as file:
+            # a record cut off by a crash would otherwise swallow the first one appended after it. Appends are made
+            # under the object's lock, unlike loads, so this is the only place where it can be removed safely
+            if file.seek(0, os.SEEK_END):
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    file.seek(0)
+                    file.truncate(file.read().rfind(b'\n') + 1)
+            
+            file.write(lines)
+            if fsync:
+                file.flush()
+                os.fsync(file.fileno())
+            return file.tell()
+    
+    
+    def ids(self, folder: str) -> Iterator[str]:
+        if not os.path.isdir(folder):
+            return
+        
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json') and entry.is_file():
+                    yield entry.name.removesuffix('.json')
+    
+    
+    def delete(self, folder: str, id: str) -> None:
+        # the backup goes first, so that it is never read in place of a snapshot which was already removed
+        path = self.path(folder, id)
+        for name in (f'{path}.bak', path, self.journal_path(folder, id)):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+    
+    
+    def flush(self) -> None:
+        with self._lock:
+            folders, self._unsynced = self._unsynced, set()
+        
+        for folder in folders:
+            descriptor = os.open(folder, os.O_RDONLY)
+            try:
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+
+
+class SQLiteStorage(Storage):
+    '''Stores every object as a row of a single SQLite database in WAL mode, with journal records in a second table.
+    
+    Versions are checksums of the stored rows. Writes are coalesced in memory and committed together once `batch_size`
+    of them are pending or `interval` seconds have passed, so a crash loses at most one batch. Other processes only see
+    writes once they are committed, which shared objects do by flushing before they release their lock.
+    
+    Commits run with `synchronous=NORMAL`, which only makes them durable once the WAL is checkpointed. Writes made with
+    `fsync` are committed straight away with `synchronous=FULL`, which syncs the WAL on every commit.'''
+    
+    def __init__(self, path: str, batch_size: int = 100, interval: float = 1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._lock = threading.RLock()
+        self._pending: dict[tuple[str, str], str] = {}
+        self._pending_records: dict[tuple[str, str], list[str]] = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._synchronous = 'NORMAL'
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS records (
+                folder TEXT NOT NULL,
+                id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (folder, id)
+            ) WITHOUT ROWID
+        ''')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY,
+                folder TEXT NOT NULL,
+                id TEXT NOT NULL,
+                record TEXT NOT NULL
+            )
+        ''')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS journal_object ON journal (folder, id, seq)')
+        
+        # commit stragglers even if no more writes come in
+        thread = threading.Thread(target=self._flusher, name='sqlite-flusher', daemon=True)
+        thread.start()
+        atexit.register(self.flush)
+    
+    
+    def _snapshot(self, folder: str, id: str) -> str | None:
+        text = self._pending.get((folder, id))
+        if text is None:
+            row = self._connection.execute(
+                'SELECT data FROM records WHERE folder = ? AND id = ?', (folder, id)
+            ).fetchone()
+            if row is not None:
+                text = row[0]
+        return text
+    
+    
+    def _journal(self, folder: str, id: str) -> list[str]:
+        # a pending snapshot makes the committed journal obsolete
+        records: list[str] = []
+        if (folder, id) not in self._pending:
+            rows = self._connection.execute(
+                'SELECT record FROM journal WHERE folder = ? AND id = ? ORDER BY seq', (folder, id)
+            ).fetchall()
+            records = [row[0] for row in rows]
+        return records + self._pending_records.get((folder, id), [])
+    
+    
+    def _journal_size(self, folder: str, id: str) -> int:
+        size = sum(len(record) for record in self._pending_records.get((folder, id), []))
+        if (folder, id) not in self._pending:
+            row = self._connection.execute(
+                'SELECT coalesce(sum(length(record)), 0) FROM journal WHERE folder = ? AND id = ?', (folder, id)
+            ).fetchone()
+            size += row[0]
+        return size
+    
+    
+    def load(self, folder: str, id: str) -> dict[str, Any] | None:
+        with self._lock:
+            text = self._snapshot(folder, id)
+            records = self._journal(folder, id)
+        
+        if text is None and not records:
+            return None
+        
+        try:
+            data: dict[str, Any] = codec.loads(text) if text is not None else {}
+            return replay(data, [codec.loads(record) for record in records])
+        except codec.DecodeError:
+            return None
+    
+    
+    def save(self, folder: str, id: str, data: dict[str, Any], fsync: bool = False) -> Hashable:
+        text = codec.dumps(data).decode()
+        with self._lock:
+            self._pending[folder, id] = text
+            self._pending_records.pop((folder, id), None)
+            if fsync or len(self._pending) >= self.batch_size:
+                self._commit(durable=fsync)
+        
+        return zlib.crc32(text.encode()), 0
+    
+    
+    def version(self, folder: str, id: str) -> Hashable:
+        with self._lock:
+            text = self._snapshot(folder, id)
+            journal = self._journal_size(folder, id)
+        
+        if text is None and not journal:
+            return None
+        return zlib.crc32(text.encode()) if text is not None else None, journal
+    
+    
+    def append(self, folder: str, id: str, records: list[dict[str, Any]], fsync: bool = False) -> int:
+        with self._lock:
+            self._pending_records.setdefault((folder, id), []).extend(codec.dumps(record).decode() for record in records)
+            size = self._journal_size(folder, id)
+            if fsync or len(self._pending) + len(self._pending_records) >= self.batch_size:
+                self._commit(durable=fsync)
+        
+        return size
+    
+    
+    def ids(self, folder: str) -> Iterator[str]:
+        # make sure that objects which haven't been committed yet are included
+        self.flush()
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT id FROM records WHERE folder = ? UNION SELECT id FROM journal WHERE folder = ?', (folder, folder)
+            ).fetchall()
+        
+        for row in rows:
+            yield row[0]
+    
+    
+    def delete(self, folder: str, id: str) -> None:
+        with self._lock:
+            self._pending.pop((folder, id), None)
+            self._pending_records.pop((folder, id), None)
+            
+            self._connection.execute('BEGIN')
+            try:
+                self._connection.execute('DELETE FROM records WHERE folder = ? AND id = ?', (folder, id))
+                self._connection.execute('DELETE FROM journal WHERE folder = ? AND id = ?', (folder, id))
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+    
+    
+    def flush(self) -> None:
+        self._commit()
+    
+    
+    def _commit(self, durable: bool = False):
+        with self._lock:
+            if not self._pending and not self._pending_records:
+                return
+            
+            # the pragma can't be changed inside a transaction, and is only changed when the durability does
+            synchronous = 'FULL' if durable else 'NORMAL'
+            if synchronous != self._synchronous:
+                self._connection.execute(f'PRAGMA synchronous={synchronous}')
+                self._synchronous = synchronous
+            
+            snapshots = [(folder, id, text) for (folder, id), text in self._pending.items()]
+            records = [
+                (folder, id, record)
+                for (folder, id), texts in self._pending_records.items()
+                for record in texts
+            ]
+            
+            # pending records always come after the pending snapshot of the same object
+            self._connection.execute('BEGIN')
+            try:
+                self._connection.executemany(
+                    'DELETE FROM journal WHERE folder = ? AND id = ?', [(folder, id) for folder, id, _ in snapshots]
+                )
+                self._connection.executemany('INSERT OR REPLACE INTO records (folder, id, data) VALUES (?, ?, ?)', snapshots)
+                self._connection.executemany('INSERT INTO journal (folder, id, record) VALUES (?, ?, ?)', records)
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+            self._pending.clear()
+            self._pending_records.clear()
+    
+    
+    def _flusher(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+@cache
+def open_storage(url: str, compact: bool = False) -> Storage:
+    '''Returns the storage backend described by a url such as `file` or `sqlite:///data/spotipy.db`. Compact files
+    aren't indented, which makes them smaller and faster to write.'''
+    
+    if url == 'file':
+        return FileStorage(indent=None if compact else 4)
+    
+    if url.startswith('sqlite:///'):
+        return SQLiteStorage(url.removeprefix('sqlite:///'))
+    
+    raise ValueError(f'Unknown storage backend "{url}".')
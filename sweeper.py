@@ -0,0 +1,111 @@
+'''Checks the tokens of every stored user and marks the ones whose access was revoked as inactive, so that their events
+no longer cost any api calls.
+
+Tokens which are about to expire are refreshed, which is what the next event would do anyway. With `--verify`, every
+user also makes a cheap call to each api, which catches tokens that were revoked before they expired.
+
+Every sweep also removes the cached metadata of tracks which haven't been fetched for longer than `METADATA_TTL`, so
+the track cache on disk only holds the tracks played recently.
+
+usage: python sweeper.py [user ids...] [--workers N] [--batch N] [--verify] [--interval S]'''
+
+import time, traceback
+from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, Literal
+
+from governor import RateLimited, background
+from track import Track
+from user import Revoked, User
+
+
+Outcome = Literal['active', 'inactive', 'incomplete', 'revoked', 'failed']
+
+
+def check(id: str, verify: bool = False) -> Outcome:
+    '''Validates the tokens of a user, marking them inactive if they were revoked.'''
+    
+    user = User(id)
+    if not user.active:
+        return 'inactive'
+    
+    try:
+        # users who never finished subscribing can't be handled until they do, unless they just did
+        if not user.strava_refresh_token or not user.spotify_refresh_token:
+            with user.transaction():
+                incomplete = not user.strava_refresh_token or not user.spotify_refresh_token
+                if incomplete:
+                    user.active = False
+            if incomplete:
+                return 'incomplete'
+        
+        user.refresh()
+        if verify:
+            user.strava_request('GET', 'athlete')
+            user.spotify_request('GET', 'me')
+    except Revoked:
+        return 'revoked'
+    except RateLimited:
+        raise
+    except Exception:
+        print(f'Failed to check user {id}.')
+        traceback.print_exc()
+        return 'failed'
+    
+    # the verification calls refresh rejected tokens, which may reveal that they were revoked
+    return 'active' if user.active else 'revoked'
+
+
+def batches(ids: Iterable[str], size: int) -> Iterator[list[str]]:
+    iterator = iter(ids)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def sweep(ids: Iterable[str], workers: int = 4, batch: int = 100, verify: bool = False) -> Counter[Outcome]:
+    '''Checks users in batches, so that only a batch of them is held in memory and in flight at once.'''
+    
+    outcomes: Counter[Outcome] = Counter()
+    
+    # live webhooks keep a share of the rate limits for themselves
+    def run(id: str) -> Outcome:
+        with background():
+            return check(id, verify)
+    
+    with ThreadPoolExecutor(workers) as executor:
+        for ids in batches(ids, batch):
+            outcomes.update(executor.map(run, ids))
+    return outcomes
+
+
+def main(ids: list[str], workers: int, batch: int, verify: bool):
+    started = time.time()
+    try:
+        outcomes = sweep(ids or User.ids(active=True), workers, batch, verify)
+    except RateLimited as e:
+        print(f'Stopped sweeping: {e}')
+        return
+    
+    summary = ', '.join(f'{count} {outcome}' for outcome, count in sorted(outcomes.items()))
+    print(f'Swept {sum(outcomes.values())} users in {time.time() - started:.1f}s: {summary or "none"}.')
+    
+    started = time.time()
+    print(f'Removed {Track.expire()} expired tracks in {time.time() - started:.1f}s.')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Marks users whose strava or spotify access was revoked as inactive.')
+    parser.add_argument('ids', nargs='*', help='users to check (default: every active one)')
+    parser.add_argument('--workers', type=int, default=4, help='how many users are checked at once (default: 4)')
+    parser.add_argument('--batch', type=int, default=100, help='how many users are loaded at once (default: 100)')
+    parser.add_argument('--verify', action='store_true', help='also call both apis to catch tokens revoked before expiring')
+    parser.add_argument('--interval', type=float, help='keep sweeping every this many seconds (default: sweep once)')
+    args = parser.parse_args()
+    
+    while True:
+        main(args.ids, args.workers, args.batch, args.verify)
+        if not args.interval:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,165 @@
+import multiprocessing
+from dataclasses import field
+from typing import Any, Callable, cast
+
+import pytest
+
+import codec
+from jsondata import ConflictError, JSONData
+from storage import FileStorage, SQLiteStorage, Storage
+
+
+STORAGES: dict[str, Callable[[str], Storage]] = {
+    'file': lambda folder: FileStorage(),
+    'sqlite': lambda folder: SQLiteStorage(f'{folder}/data.db')
+}
+
+
+def counter(folder: str, storage: Storage) -> type[JSONData]:
+    class Counter(JSONData, folder=f'{folder}/counters', storage=storage, shared=True):
+        count: int = 0
+    
+    return Counter
+
+
+def run(target: Callable[..., Any], *args: Any):
+    # forked processes inherit the classes, along with their own connections to the storage
+    process = multiprocessing.get_context('fork').Process(target=target, args=args)
+    process.start()
+    return process
+
+
+@pytest.mark.parametrize('backend', STORAGES)
+def test_transactions_across_processes(tmp_path: Any, backend: str):
+    Counter = counter(str(tmp_path), STORAGES[backend](str(tmp_path)))
+    
+    def increment(times: int):
+        obj = Counter('a')
+        for _ in range(times):
+            with obj.transaction():
+                obj.count += 1
+    
+    processes = [run(increment, 50) for _ in range(4)]
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    
+    assert Counter('a').count == 200
+
+
+@pytest.mark.parametrize('backend', STORAGES)
+def test_conflict_reloads(tmp_path: Any, backend: str):
+    Counter = counter(str(tmp_path), STORAGES[backend](str(tmp_path)))
+    obj = Counter('a')
+    obj.count = 1
+    
+    def overwrite():
+        Counter('a').count = 5
+    
+    process = run(overwrite)
+    process.join()
+    assert process.exitcode == 0
+    
+    # a write without a transaction can't tell whether it was meant to replace the other process's one
+    with pytest.raises(ConflictError):
+        with obj.batch():
+            obj.count += 1
+    
+    # the object doesn't hold on to the lost change, so it can be used again
+    assert obj.count == 5
+    with obj.transaction():
+        obj.count += 1
+    assert obj.count == 6
+
+
+def test_eviction_ignores_conflicts(tmp_path: Any):
+    class Cached(JSONData, folder=f'{tmp_path}/cached', flush_interval=3600, capacity=1, shared=True):
+        count: int = 0
+    
+    obj = Cached('a')
+    obj.count = 1
+    
+    def overwrite():
+        with Cached('a').transaction() as other:
+            other.count = 5
+    
+    process = run(overwrite)
+    process.join()
+    assert process.exitcode == 0
+    
+    # evicting the first object must not fail for whoever loads the second one
+    Cached('b')
+    assert Cached('a').count == 5
+
+
+def test_evicted_objects_in_use(tmp_path: Any):
+    class Cached(JSONData, folder=f'{tmp_path}/cached', capacity=1):
+        count: int = 0
+    
+    obj = Cached('a')
+    Cached('b')
+    
+    # an evicted object which is still held elsewhere mustn't be loaded a second time
+    assert Cached('a') is obj
+    obj.count = 1
+    
+    del obj
+    Cached('b')
+    assert Cached('a').count == 1
+
+
+def test_ids_are_strings(tmp_path: Any):
+    class Item(JSONData, folder=f'{tmp_path}/items'):
+        count: int = 0
+    
+    # ids which are passed as ints get the same instance, whoever asked for it first
+    assert Item('1') is Item(1)
+    assert Item(1).id == '1'
+    assert Item(2).id == Item('2').id == '2'
+
+
+def test_journal_across_processes(tmp_path: Any):
+    class Log(JSONData, folder=f'{tmp_path}/logs', shared=True, journal=True):
+        items: list[int] = field(default_factory=list[int])
+    
+    obj = Log('a')
+    obj.items.append(0)
+    
+    # a crash in the middle of an append
+    with open(cast(FileStorage, Log.STORAGE).journal_path(f'{tmp_path}/logs', 'a'), 'ab') as file:
+        file.write(b'{"g":"')
+    
+    def extend(start: int):
+        other = Log('a')
+        for i in range(start, start + 20):
+            with other.transaction():
+                other.items.append(i)
+    
+    processes = [run(extend, start) for start in (1, 21)]
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    
+    # the journal is replayed on top of the snapshot, and loading it doesn't make it look changed
+    with obj.transaction():
+        assert sorted(obj.items) == list(range(41))
+        obj.items.append(41)
+    assert sorted(codec.parsed(cast(dict[str, Any], Log.STORAGE.load(f'{tmp_path}/logs', 'a'))['items'])) == list(range(42))
+
+
+def test_set_updates(tmp_path: Any):
+    class Tags(JSONData, folder=f'{tmp_path}/tags'):
+        values: set[int] = field(default_factory=set[int], metadata={'retention': 3})
+    
+    obj = Tags('a')
+    obj.values.update([1, 2, 3])
+    obj.values.intersection_update([2, 3, 4])
+    obj.values.symmetric_difference_update([3, 5, 6])
+    
+    # retention keeps the most recently added elements
+    assert obj.values == {2, 5, 6}
+    obj.values.add(7)
+    assert obj.values == {5, 6, 7}
+    
+    obj.reload()
+    assert obj.values == {5, 6, 7}
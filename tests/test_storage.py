@@ -0,0 +1,70 @@
+from typing import Any
+
+import codec
+from storage import FileStorage, SQLiteStorage, Storage
+
+
+def load(storage: Storage, folder: str, id: str) -> dict[str, Any] | None:
+    # sections which weren't replayed are left unparsed
+    data = storage.load(folder, id)
+    return {name: codec.parsed(value) for name, value in data.items()} if data is not None else None
+
+
+def test_journal_replay(tmp_path: Any):
+    storage = FileStorage()
+    folder = str(tmp_path)
+    storage.save(folder, 'a', {'items': [1], 'names': {}})
+    storage.append(folder, 'a', [
+        {'op': 'append', 'field': 'items', 'args': [2]},
+        {'op': 'setitem', 'field': 'names', 'args': ['x', 'y']}
+    ])
+    
+    assert load(FileStorage(), folder, 'a') == {'items': [1, 2], 'names': {'x': 'y'}}
+    
+    # a new snapshot makes the journal obsolete, even if it is left behind
+    storage.save(folder, 'a', {'items': [3], 'names': {}})
+    assert load(FileStorage(), folder, 'a') == {'items': [3], 'names': {}}
+
+
+def test_journal_cut_off(tmp_path: Any):
+    storage = FileStorage()
+    folder = str(tmp_path)
+    storage.save(folder, 'a', {'items': []})
+    storage.append(folder, 'a', [{'op': 'append', 'field': 'items', 'args': [1]}])
+    
+    # a crash in the middle of an append
+    with open(storage.journal_path(folder, 'a'), 'ab') as file:
+        file.write(b'{"g":"')
+    
+    # loading leaves the journal alone, so it doesn't look like it was changed by someone else
+    version = storage.version(folder, 'a')
+    assert load(FileStorage(), folder, 'a') == {'items': [1]}
+    assert storage.version(folder, 'a') == version
+    
+    # the next append removes the partial record rather than being swallowed by it
+    storage.append(folder, 'a', [{'op': 'append', 'field': 'items', 'args': [2]}])
+    assert load(FileStorage(), folder, 'a') == {'items': [1, 2]}
+
+
+def test_sqlite_journal_replay(tmp_path: Any):
+    storage = SQLiteStorage(f'{tmp_path}/data.db')
+    storage.save('folder', 'a', {'items': [1]})
+    storage.append('folder', 'a', [{'op': 'append', 'field': 'items', 'args': [2]}])
+    storage.flush()
+    
+    assert load(SQLiteStorage(f'{tmp_path}/data.db'), 'folder', 'a') == {'items': [1, 2]}
+
+
+def test_delete(tmp_path: Any):
+    for storage in (FileStorage(), SQLiteStorage(f'{tmp_path}/data.db')):
+        folder = f'{tmp_path}/folder'
+        storage.save(folder, 'a', {'items': [1]})
+        storage.save(folder, 'a', {'items': [2]})
+        storage.append(folder, 'a', [{'op': 'append', 'field': 'items', 'args': [3]}])
+        storage.save(folder, 'b', {'items': []})
+        
+        # neither the backup nor the journal are left behind to be read instead
+        storage.delete(folder, 'a')
+        assert load(storage, folder, 'a') is None
+        assert storage.version(folder, 'a') is None
+        assert list(storage.ids(folder)) == ['b']
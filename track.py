@@ -0,0 +1,98 @@
+import time
+from dataclasses import field
+from typing import Any, cast
+
+from constants import AUDIO_FEATURES, COMPACT_STORAGE, DURABILITY, FLUSH_INTERVAL, METADATA_CACHE_SIZE, METADATA_TTL, STORAGE
+from jsondata import Durability, JSONData
+from storage import open_storage
+from user import User
+
+
+# the most ids spotify accepts per request
+FEATURES_PER_REQUEST = 100
+
+
+class Track(
+    JSONData,
+    folder='data/tracks',
+    storage=open_storage(STORAGE, compact=COMPACT_STORAGE),
+    flush_interval=FLUSH_INTERVAL,
+    durability=cast(Durability, DURABILITY),
+    capacity=METADATA_CACHE_SIZE
+):
+    '''Metadata of a spotify track, which is shared by every user who played it and refetched once it is too old.'''
+    
+    name: str = ''
+    artists: list[str] = field(default_factory=list[str])
+    album: str = ''
+    duration_ms: int = 0
+    fetched_at: float = 0
+    
+    # beats per minute, from the audio features
+    tempo: float = 0
+    features_at: float = 0
+    
+    
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.fetched_at + METADATA_TTL
+    
+    
+    @classmethod
+    def expire(cls) -> int:
+        '''Removes the stored tracks whose metadata is too old to be used, so that tracks which nobody plays anymore
+        don't pile up on disk, and returns how many were removed.'''
+        
+        folder = cast(str, cls.FOLDER)
+        now = time.time()
+        expired = 0
+        for id in cls.STORAGE.ids(folder):
+            # a track which is played again is simply fetched again
+            data = cls.STORAGE.load(folder, id) or {}
+            if now >= data.get('fetched_at', 0) + METADATA_TTL:
+                cls.STORAGE.delete(folder, id)
+                expired += 1
+        return expired
+    
+    
+    @classmethod
+    def remember(cls, data: dict[str, Any]) -> 'Track':
+        '''Returns the track of a full spotify track object, storing its metadata unless it is still fresh.'''
+        
+        # local files have no id, so they can't be shared
+        track = cls(data.get('id') or '')
+        if not track.fresh:
+            track.set(
+                name=data['name'],
+                artists=[artist['name'] for artist in data['artists']],
+                album=data.get('album', {}).get('name', ''),
+                duration_ms=data.get('duration_ms', 0),
+                fetched_at=time.time()
+            )
+        return track
+    
+    
+    @classmethod
+    def features(cls, user: User, tracks: list['Track']):
+        '''Fetches the audio features of the tracks which don't have recent ones in bulk.'''
+        
+        missing = {str(track.id): track for track in tracks if track.id and time.time() >= track.features_at + METADATA_TTL}
+        ids = list(missing)
+        for i in range(0, len(ids), FEATURES_PER_REQUEST):
+            json = user.spotify_request('GET', f'audio-features?ids={",".join(ids[i:i + FEATURES_PER_REQUEST])}')
+            
+            # tracks without features are remembered as well so that they aren't asked for again and again
+            found: list[dict[str, Any] | None] = json.get('audio_features') or []
+            features = {data['id']: data for data in found if data}
+            for id in ids[i:i + FEATURES_PER_REQUEST]:
+                missing[id].set(tempo=features.get(id, {}).get('tempo', 0), features_at=time.time())
+    
+    
+    @classmethod
+    def played(cls, user: User, items: list[dict[str, Any]]) -> list['Track']:
+        '''Returns the tracks of recently played items, which already contain their metadata.'''
+        
+        tracks = [cls.remember(item['track']) for item in items]
+        if AUDIO_FEATURES:
+            cls.features(user, tracks)
+        return tracks
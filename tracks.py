@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable
+
+from constants import TRACK_CACHE_SIZE
+from user import User
+
+
+# the most items spotify returns per page
+PAGE_SIZE = 50
+
+# recently played items by user and time window, most recently used last
+_cache: OrderedDict[tuple[str, float, float], list[dict[str, Any]]] = OrderedDict()
+_lock = threading.Lock()
+
+
+def timestamp(date: str) -> float:
+    '''Converts an ISO 8601 date from strava or spotify to a unix timestamp.'''
+    
+    return datetime.fromisoformat(date.replace('Z', '+00:00')).timestamp()
+
+
+def window(activity: dict[str, Any]) -> tuple[float, float]:
+    '''Returns the start and end time of a strava activity.'''
+    
+    start = timestamp(activity['start_date'])
+    return start, start + activity['elapsed_time']
+
+
+def _cached(key: tuple[str, float, float]) -> list[dict[str, Any]] | None:
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return list(_cache[key])
+    return None
+
+
+def _remember(key: tuple[str, float, float], items: list[dict[str, Any]]):
+    # nothing might have been played yet because spotify is slow to record plays, so only remember what was found
+    if items:
+        with _lock:
+            _cache[key] = items
+            if len(_cache) > TRACK_CACHE_SIZE:
+                _cache.popitem(last=False)
+
+
+def _page(json: dict[str, Any], start: float, end: float, before: int) -> tuple[list[dict[str, Any]], int | None]:
+    '''Returns the items of a page which were played during a time window, and the cursor of the next page if the
+    window continues on it.'''
+    
+    page: list[dict[str, Any]] = json.get('items', [])
+    items = [item for item in page if start <= timestamp(item['played_at']) <= end]
+    
+    # pages are newest first, so the window is done once a page reaches back before it
+    cursors: dict[str, Any] = json.get('cursors') or {}
+    cursor: str | None = cursors.get('before')
+    if not page or not json.get('next') or not cursor or int(cursor) >= before or timestamp(page[-1]['played_at']) < start:
+        return items, None
+    return items, int(cursor)
+
+
+def played(user: User, start: float, end: float, spend: Callable[[], object] | None = None) -> list[dict[str, Any]]:
+    '''Returns the recently played items which were played during a time window, newest first.
+    
+    The history is paged backwards from the end of the window and stops as soon as it passes its start. `spend` is
+    called before every request.'''
+    
+    key = (user.id, start, end)
+    cached = _cached(key)
+    if cached is not None:
+        return cached
+    
+    items: list[dict[str, Any]] = []
+    before: int | None = int(end * 1000)
+    while before is not None:
+        if spend:
+            spend()
+        json = user.spotify_request('GET', f'me/player/recently-played?limit={PAGE_SIZE}&before={before}')
+        page, before = _page(json, start, end, before)
+        items += page
+    
+    _remember(key, items)
+    return list(items)
+
+
+async def aplayed(user: User, start: float, end: float, first: tuple[dict[str, Any], int] | None = None) -> list[dict[str, Any]]:
+    '''Same as `played`, but asynchronous. The first page may already have been fetched, together with its cursor,
+    while the window itself was still unknown.'''
+    
+    key = (user.id, start, end)
+    cached = _cached(key)
+    if cached is not None:
+        return cached
+    
+    items: list[dict[str, Any]] = []
+    before: int | None = int(end * 1000)
+    if first is not None:
+        json, before = first
+        page, before = _page(json, start, end, before)
+        items += page
+    
+    while before is not None:
+        json = await user.aspotify_request('GET', f'me/player/recently-played?limit={PAGE_SIZE}&before={before}')
+        page, before = _page(json, start, end, before)
+        items += page
+    
+    _remember(key, items)
+    return list(items)
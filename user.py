@@ -1,118 +1,288 @@
-from typing import Literal
-import requests
+import asyncio, time
+from typing import Any, Literal, NoReturn, TypeAlias, cast
+from weakref import WeakValueDictionary
 from dataclasses import field
 
-from constants import SPOTIFY_API_URL, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_TOKEN_URL, STRAVA_API_URL, STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET, STRAVA_TOKEN_URL
-from jsondata import JSONData
+from aclient import AsyncClient, aspotify, astrava
+from client import Client, spotify, strava
+from constants import ACTIVITY_RETENTION, COMPACT_STORAGE, DURABILITY, FLUSH_INTERVAL, JOURNAL, SHARED_DATA, SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_TOKEN_URL, STORAGE, STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET, STRAVA_TOKEN_URL, TOKEN_EXPIRY_MARGIN, USER_CACHE_SIZE
+from jsondata import Durability, JSONData
+from metrics import span
+from storage import open_storage
 
 
-class User(JSONData, folder='data/users'):
-    active: bool = True
+Api: TypeAlias = Literal['strava', 'spotify']
+Method: TypeAlias = Literal['GET', 'POST', 'PATCH', 'PUT', 'DELETE']
+
+# the synchronous and asynchronous methods only differ in which of these clients they wait for
+CLIENTS: dict[Api, Client] = {'strava': strava, 'spotify': spotify}
+ASYNC_CLIENTS: dict[Api, AsyncClient] = {'strava': astrava, 'spotify': aspotify}
+
+TOKEN_URLS: dict[Api, str] = {'strava': STRAVA_TOKEN_URL, 'spotify': SPOTIFY_TOKEN_URL}
+CREDENTIALS: dict[Api, tuple[str, str]] = {
+    'strava': (STRAVA_CLIENT_ID, STRAVA_CLIENT_SECRET),
+    'spotify': (SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET)
+}
+
+# one lock per user and api so that concurrent callers share a single refresh, which is forgotten once nobody holds or
+# waits for it anymore
+_async_refresh_locks: WeakValueDictionary[tuple[str, str], asyncio.Lock] = WeakValueDictionary()
+
+
+class Revoked(Exception):
+    '''Raised when an api refuses a user's refresh token for good, after which the user is marked inactive.'''
+
+
+class User(
+    JSONData,
+    folder='data/users',
+    storage=open_storage(STORAGE, compact=COMPACT_STORAGE),
+    flush_interval=FLUSH_INTERVAL,
+    durability=cast(Durability, DURABILITY),
+    capacity=USER_CACHE_SIZE,
+    shared=SHARED_DATA,
+    journal=JOURNAL
+):
+    active: bool = field(default=True, metadata={'index': True})
     
     strava_refresh_token: str = ''
     strava_access_token: str = ''
-    activities: list[int] = field(default_factory=list)
+    strava_expires_at: float = 0
+    activities: set[int] = field(default_factory=set[int], metadata={'retention': ACTIVITY_RETENTION})
     
     spotify_refresh_token: str = ''
     spotify_access_token: str = ''
+    spotify_expires_at: float = 0
+    
+    # start time of the last activity which was backfilled
+    backfill_after: int = 0
+    
+    # template of the music added to descriptions, or empty for the default one
+    template: str = ''
     
     
     @classmethod
     def strava_authorize(cls, code: str):
-        json = requests.post(
-            STRAVA_TOKEN_URL,
-            data={
-                'client_id': STRAVA_CLIENT_ID,
-                'client_secret': STRAVA_CLIENT_SECRET,
-                'code': code,
-                'grant_type': 'authorization_code'
-            }
-        ).json()
-        
+        json = strava.post(STRAVA_TOKEN_URL, data=cls._grant('strava', 'authorization_code', code=code)).json()
         user = cls(json['athlete']['id'])
-        user.strava_refresh_token = json['refresh_token']
-        user.strava_access_token = json['access_token']
+        user._authorized('strava', json)
         return user
-        
+    
     
     def strava_refresh(self):
-        json = requests.post(
-            STRAVA_TOKEN_URL,
-            data={
-                'client_id': STRAVA_CLIENT_ID,
-                'client_secret': STRAVA_CLIENT_SECRET,
-                'grant_type': 'refresh_token',
-                'refresh_token': self.strava_refresh_token
-            },
-        ).json()
-        
-        self.strava_access_token = json['access_token']
-        return self.strava_access_token
+        return self._refresh('strava')
     
     
-    def strava_request(self, method: Literal['GET', 'POST', 'PATCH', 'PUT', 'DELETE'], url: str, data: dict[str, str] | None = None):
-        function = {
-            'GET': requests.get,
-            'POST': requests.post,
-            'PATCH': requests.patch,
-            'PUT': requests.put,
-            'DELETE': requests.delete
-        }[method]
-        
-        return function(
-            f'{STRAVA_API_URL}/{url}',
-            data=data,
-            headers={'Authorization': f'Bearer {self.strava_access_token}'}
-        ).json()
+    def strava_request(self, method: Method, url: str, data: dict[str, str] | None = None):
+        return self._request('strava', method, url, data)
     
     
     def spotify_authorize(self, code: str, redirect_uri: str):
-        json = requests.post(
+        json = spotify.post(
             SPOTIFY_TOKEN_URL,
-            data={
-                'client_id': SPOTIFY_CLIENT_ID,
-                'client_secret': SPOTIFY_CLIENT_SECRET,
-                'code': code,
-                'grant_type': 'authorization_code',
-                'redirect_uri': redirect_uri
-            }
+            data=self._grant('spotify', 'authorization_code', code=code, redirect_uri=redirect_uri)
         ).json()
-
-        self.spotify_refresh_token = json['refresh_token']
-        self.spotify_access_token = json['access_token']
+        self._authorized('spotify', json)
         return self.spotify_access_token
     
     
     def spotify_refresh(self):
-        json = requests.post(
-            SPOTIFY_TOKEN_URL,
-            data={
-                'client_id': SPOTIFY_CLIENT_ID,
-                'client_secret': SPOTIFY_CLIENT_SECRET,
-                'grant_type': 'refresh_token',
-                'refresh_token': self.spotify_refresh_token
-            }
-        ).json()
+        return self._refresh('spotify')
+    
+    
+    def spotify_request(self, method: Method, url: str, data: dict[str, str] | None = None):
+        return self._request('spotify', method, url, data)
+    
+    
+    def _refresh(self, api: Api) -> str:
+        response = CLIENTS[api].post(TOKEN_URLS[api], data=self._refresh_grant(api))
+        self._refreshed(api, response.status_code, response.json())
+        return getattr(self, f'{api}_access_token')
+    
+    
+    def _request(self, api: Api, method: Method, url: str, data: dict[str, str] | None = None) -> Any:
+        token = self.token(api)
+        response = CLIENTS[api].request(method, url, data=data, headers=self._bearer(token))
         
-        self.spotify_access_token = json['access_token']
-        return self.spotify_access_token
+        # the token was revoked or expired early, so try once more with a new one
+        if response.status_code == 401:
+            token = self.token(api, stale=token)
+            response = CLIENTS[api].request(method, url, data=data, headers=self._bearer(token))
+        
+        return response.json()
     
     
-    def spotify_request(self, method: Literal['GET', 'POST', 'PATCH', 'PUT', 'DELETE'], url: str, data: dict[str, str] | None = None):
-        function = {
-            'GET': requests.get,
-            'POST': requests.post,
-            'PATCH': requests.patch,
-            'PUT': requests.put,
-            'DELETE': requests.delete
-        }[method]
+    @staticmethod
+    def _grant(api: Api, grant_type: str, **params: str) -> dict[str, str]:
+        '''Returns the form of a request to an api's token endpoint.'''
         
-        return function(
-            f'{SPOTIFY_API_URL}/{url}',
-            data=data,
-            headers={'Authorization': f'Bearer {self.spotify_access_token}'}
-        ).json()
-
-
+        client_id, client_secret = CREDENTIALS[api]
+        return {'client_id': client_id, 'client_secret': client_secret, 'grant_type': grant_type, **params}
+    
+    
+    def _refresh_grant(self, api: Api) -> dict[str, str]:
+        return self._grant(api, 'refresh_token', refresh_token=getattr(self, f'{api}_refresh_token'))
+    
+    
+    @staticmethod
+    def _bearer(token: str) -> dict[str, str]:
+        return {'Authorization': f'Bearer {token}'}
+    
+    
+    @staticmethod
+    def _tokens(api: Api, json: dict[str, Any]) -> dict[str, Any]:
+        '''Returns the fields set by a response of an api's token endpoint, which may rotate the refresh token as well.'''
+        
+        match api:
+            case 'strava':
+                expires_at = json['expires_at']
+            case 'spotify':
+                expires_at = time.time() + json['expires_in']
+        
+        return {
+            f'{api}_refresh_token': json.get('refresh_token', ...),
+            f'{api}_access_token': json['access_token'],
+            f'{api}_expires_at': expires_at
+        }
+    
+    
+    def _store(self, **fields: Any):
+        # a transaction reloads the user first if another process changed it, so the write can't conflict, which
+        # would lose tokens that were already rotated
+        with self.transaction():
+            self.set(**fields)
+    
+    
+    def _authorized(self, api: Api, json: dict[str, Any]):
+        '''Stores the tokens of an authorization response and reactivates the user. Writes wait for the disk and
+        possibly other processes, so asynchronous callers run this on a thread, like `_refreshed`.'''
+        
+        self._store(active=True, **self._tokens(api, json))
+    
+    
+    def _refreshed(self, api: Api, status: int, json: dict[str, Any]):
+        '''Stores the tokens of a refresh response, or marks the user inactive if the api revoked their access.'''
+        
+        if 'access_token' not in json:
+            self._refused(api, status, json)
+        self._store(**self._tokens(api, json))
+    
+    
+    def _refused(self, api: Api, status: int, error: dict[str, Any]) -> NoReturn:
+        # only a refresh token which was rejected as invalid was revoked by the user, anything else, like a rate limit
+        # or a misconfigured client, is worth retrying
+        match api:
+            case 'strava':
+                errors: list[dict[str, Any]] = error.get('errors') or []
+                revoked = any(e.get('resource') == 'RefreshToken' and e.get('code') == 'invalid' for e in errors)
+            case 'spotify':
+                revoked = error.get('error') == 'invalid_grant'
+        
+        if revoked:
+            self._store(active=False)
+            raise Revoked(f'The {api} access of user {self.id} was revoked.')
+        raise RuntimeError(f'Could not refresh the {api} token of user {self.id}: {status} {error}')
+    
+    
+    def _fresh(self, api: Api, stale: str | None = None) -> bool:
+        token: str = getattr(self, f'{api}_access_token')
+        expires_at: float = getattr(self, f'{api}_expires_at')
+        
+        # a rejected token only needs refreshing if nobody has replaced it yet
+        if stale is not None:
+            return token != stale
+        return bool(token) and time.time() < expires_at - TOKEN_EXPIRY_MARGIN
+    
+    
+    def token(self, api: Api, stale: str | None = None) -> str:
+        '''Returns a valid access token, refreshing it only if it is about to expire or was rejected.'''
+        
+        if not self._fresh(api, stale):
+            # the transaction's lock keeps threads apart as well, and taking a lock of our own before it would deadlock
+            # with callers which are inside a transaction already
+            with self.transaction():
+                # another caller, possibly in another process, may have refreshed the token while we were waiting
+                if not self._fresh(api, stale):
+                    with span('token_refresh', api=api):
+                        self._refresh(api)
+        
+        return getattr(self, f'{api}_access_token')
+    
+    
     def refresh(self):
-        return self.strava_refresh(), self.spotify_refresh()
+        '''Ensures that both access tokens are valid, refreshing only the ones that are about to expire.'''
+        
+        return self.token('strava'), self.token('spotify')
+    
+    
+    @classmethod
+    async def astrava_authorize(cls, code: str):
+        json = (await astrava.post(STRAVA_TOKEN_URL, data=cls._grant('strava', 'authorization_code', code=code))).json()
+        user = cls(json['athlete']['id'])
+        await asyncio.to_thread(user._authorized, 'strava', json)
+        return user
+    
+    
+    async def astrava_refresh(self):
+        return await self._arefresh('strava')
+    
+    
+    async def astrava_request(self, method: Method, url: str, data: dict[str, str] | None = None):
+        return await self._arequest('strava', method, url, data)
+    
+    
+    async def aspotify_authorize(self, code: str, redirect_uri: str):
+        json = (await aspotify.post(
+            SPOTIFY_TOKEN_URL,
+            data=self._grant('spotify', 'authorization_code', code=code, redirect_uri=redirect_uri)
+        )).json()
+        await asyncio.to_thread(self._authorized, 'spotify', json)
+        return self.spotify_access_token
+    
+    
+    async def aspotify_refresh(self):
+        return await self._arefresh('spotify')
+    
+    
+    async def aspotify_request(self, method: Method, url: str, data: dict[str, str] | None = None):
+        return await self._arequest('spotify', method, url, data)
+    
+    
+    async def _arefresh(self, api: Api) -> str:
+        response = await ASYNC_CLIENTS[api].post(TOKEN_URLS[api], data=self._refresh_grant(api))
+        await asyncio.to_thread(self._refreshed, api, response.status_code, response.json())
+        return getattr(self, f'{api}_access_token')
+    
+    
+    async def _arequest(self, api: Api, method: Method, url: str, data: dict[str, str] | None = None) -> Any:
+        token = await self.atoken(api)
+        response = await ASYNC_CLIENTS[api].request(method, url, data=data, headers=self._bearer(token))
+        
+        if response.status_code == 401:
+            token = await self.atoken(api, stale=token)
+            response = await ASYNC_CLIENTS[api].request(method, url, data=data, headers=self._bearer(token))
+        
+        return response.json()
+    
+    
+    async def atoken(self, api: Api, stale: str | None = None) -> str:
+        '''Same as `token`, but asynchronous. Concurrent callers in this process share a single refresh, but the lock
+        isn't held across processes while waiting for the api, since that would block the event loop.'''
+        
+        if not self._fresh(api, stale):
+            lock = _async_refresh_locks.setdefault((self.id, api), asyncio.Lock())
+            async with lock:
+                # another process may have refreshed the token while we were waiting
+                await asyncio.to_thread(self.revalidate)
+                
+                if not self._fresh(api, stale):
+                    with span('token_refresh', api=api):
+                        await self._arefresh(api)
+        
+        return getattr(self, f'{api}_access_token')
+    
+    
+    async def arefresh(self):
+        '''Same as `refresh`, but refreshes both tokens concurrently.'''
+        
+        return await asyncio.gather(self.atoken('strava'), self.atoken('spotify'))
@@ -0,0 +1,106 @@
+'''What the app in `main` and the asynchronous one in `asgi` have in common, which is everything but how they wait for
+the apis.'''
+
+from typing import Any, Mapping
+
+from client import spotify, strava
+from constants import SPOTIFY_AUTH_URL, SPOTIFY_CLIENT_ID, STRAVA_AUTH_URL, STRAVA_CLIENT_ID
+from events import accepted, activity_key, seen
+from jobqueue import JobQueue
+from metrics import registry
+from state import DataT, InvalidState, JWT
+from track import Track
+from user import User
+
+
+VERIFY_TOKEN = 'BEELAU'
+
+STRAVA_SCOPES = 'activity:write,activity:read_all'
+SPOTIFY_SCOPES = 'user-read-recently-played,user-read-private,user-read-email'
+
+
+class CallbackError(ValueError):
+    '''Raised for authorization callbacks which can't be handled, with a message for the user.'''
+
+
+def collect(queue: JobQueue):
+    '''Registers the metrics of the queue, caches and rate limits.'''
+    
+    registry.collect('queue', queue.metrics)
+    registry.collect('events', seen.metrics)
+    registry.collect('users', User.cache_metrics)
+    registry.collect('tracks', Track.cache_metrics)
+    registry.collect('rate_limits', lambda: {
+        'strava': strava.governor.metrics() if strava.governor else {},
+        'spotify': spotify.governor.metrics() if spotify.governor else {}
+    })
+
+
+def strava_authorization(redirect_uri: str) -> str:
+    state = JWT(src='strava')
+    return f'{STRAVA_AUTH_URL}?client_id={STRAVA_CLIENT_ID}&redirect_uri={redirect_uri}&response_type=code&scope={STRAVA_SCOPES}&state={state}'
+
+
+def spotify_authorization(redirect_uri: str, user_id: DataT) -> str:
+    state = JWT(src='spotify', user_id=user_id)
+    return f'{SPOTIFY_AUTH_URL}?client_id={SPOTIFY_CLIENT_ID}&redirect_uri={redirect_uri}&response_type=code&scope={SPOTIFY_SCOPES}&state={state}'
+
+
+def callback_state(args: Mapping[str, str]) -> JWT:
+    '''Checks the arguments of an authorization callback and returns its state.'''
+    
+    if args.get('error'):
+        raise CallbackError('EPIC FAIL! ' + args['error'])
+    
+    if not args.get('code'):
+        raise CallbackError('Missing authorization code.')
+    
+    if not args.get('state'):
+        raise CallbackError('Missing state.')
+    
+    try:
+        jwt = JWT(args['state'])
+    except InvalidState as e:
+        raise CallbackError(f'Invalid state.<br>{e}') from e
+    
+    if jwt.src not in ('strava', 'spotify'):
+        raise CallbackError(f'Invalid state.<br>Invalid source "{jwt.src}".')
+    
+    # ids are strings, but states issued before that carry them as ints
+    if jwt.src == 'spotify' and not (isinstance(jwt.user_id, (str, int)) and str(jwt.user_id).isdigit()):
+        raise CallbackError(f'Invalid state.<br>Invalid user id "{jwt.user_id}".')
+    
+    return jwt
+
+
+def receive(event: dict[str, Any] | None, queue: JobQueue):
+    '''Queues a webhook event to be handled by the workers, unless it is a duplicate or isn't handled at all.'''
+    
+    if event:
+        registry.increment('webhook_events_total', aspect_type=str(event.get('aspect_type')), object_type=str(event.get('object_type')))
+    
+    # duplicates are dropped before any work is done, and events for an activity which is still pending are merged
+    if event and accepted(event) and seen.add(event):
+        try:
+            queue.put(event, activity_key(event))
+        except BaseException:
+            # strava delivers the event again if it isn't acknowledged, which mustn't be dropped as a duplicate
+            seen.discard(event)
+            raise
+
+
+def verify_webhook(args: Mapping[str, str]) -> dict[str, Any] | tuple[str, int]:
+    mode = args.get('hub.mode')
+    token = args.get('hub.verify_token')
+    challenge = args.get('hub.challenge')
+    
+    if mode and token:
+        if mode == 'subscribe' and token == VERIFY_TOKEN:
+            return {'hub.challenge': challenge}
+        else:
+            return 'Forbidden', 403
+    return 'Bad Request', 400
+
+
+def metrics() -> tuple[str, int, dict[str, str]]:
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}